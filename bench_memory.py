@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+bench_memory.py
+
+Memory benchmark for pycocontainer: bytes per managed instance, for
+Lifecycle components and for SlottedLifecycle ones with __slots__ of
+their own, both on their own and with the container's registries and
+backing DAG counted in, and bytes per registry record, as the
+dictionaries they used to be and as the _Component records they are.
+
+Needs tracemalloc, so Python 3.4 or later.
+
+    python bench_memory.py [instances]
+
+Copyright 2013 Alexander R. Saint Croix (saintx.opensource@gmail.com)
+Published under the terms of the Apache Software License v2.0
+"""
+
+from pycocontainer import *
+from pycocontainer import _Component
+import gc
+import sys
+try:
+    import tracemalloc
+except ImportError:
+    sys.exit('bench_memory.py needs tracemalloc (Python 3.4 or later)')
+
+class Fat(Lifecycle):
+    def __init__(self, config):
+        super(Fat, self).__init__()
+        self.config = config
+
+    @startmethod
+    def up(self, *args): pass
+
+    @stopmethod
+    def down(self, *args): pass
+
+    @failmethod
+    def out(self, *args): pass
+
+class Slim(SlottedLifecycle):
+    __slots__ = ('config',)
+
+    def __init__(self, config):
+        super(Slim, self).__init__()
+        self.config = config
+
+    @startmethod
+    def up(self, *args): pass
+
+    @stopmethod
+    def down(self, *args): pass
+
+    @failmethod
+    def out(self, *args): pass
+
+
+def measure(build):
+    """
+    Returns the bytes still allocated after build() returns, keeping
+    whatever it returns alive until the measurement is taken.
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return after - before
+
+def bare(cls, n):
+    config = object()
+    return lambda: [cls(config) for i in range(n)]
+
+def records(record, n):
+    varnames = ['config']
+    return lambda: [record(name='component%s' % i, varnames=varnames, process=False,
+                           retry=None, cache=None) for i in range(n)]
+
+def managed(cls, n):
+    def build():
+        pyco = Pycocontainer('Benchmark')
+        pyco.add('config', object())
+        pyco.register(cls, cls.__name__.lower())
+        for i in range(n):
+            pyco.instance_of(cls, 'instance%s' % i)
+        pyco.start()
+        return pyco
+    return build
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print('%-10s %14s %14s' % ('', 'bare B/inst', 'managed B/inst'))
+    for cls in [Fat, Slim]:
+        print('%-10s %14.1f %14.1f' % (
+            cls.__name__, measure(bare(cls, n)) / float(n), measure(managed(cls, n)) / float(n)))
+    print('')
+    print('%-10s %14s' % ('', 'B/record'))
+    for label, record in [('dict', dict), ('_Component', _Component)]:
+        print('%-10s %14.1f' % (label, measure(records(record, n)) / float(n)))
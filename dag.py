@@ -15,35 +15,122 @@ __version__ = '.'.join(__version_info__)
 __author__ = 'Alexander R. Saint Croix'
 __license__ = 'Apache Software License v2.0'
 __copyright__ = '(c) 2013 by Alexander R. Saint Croix'
-__all__ = ['Graph']
+__all__ = ['Graph', 'ReadyQueue']
 
+import collections
 import itertools
+import threading
+import time
+
+_clock = getattr(time, 'perf_counter', time.time)
 
 class Graph(object):
-    def __init__(self):
+    def __init__(self, indexed=False, counters=False):
+        """
+        If indexed is True, the graph also maintains a transitive closure
+        index, as one integer bitset of successors and one of precursors per
+        vertex.  Reachability checks become O(1), and successor and precursor
+        queries no longer walk the edges, at the cost of O(V) bitset updates
+        on add and a full O(V+E) reindex on remove.
+
+        If counters is True, counts calls to, and time spent in, add, remove
+        and _toposort in the counters Counter.  Set counters to None to stop.
+        """
         self.edges = {}
         self.toporder = []
+        self.counters = collections.Counter() if counters else None
+        self.indexed = indexed
+        self._bits = {}
+        self._slots = []
+        self._reach = {}
+        self._reached = {}
+        self._position = {}
 
     def vertices(self):
         return self.edges.keys()
 
     def _edges_copy(self):
-        ret = {}
-        for item in self.edges:
-            ret[item] = [x for x in self.edges[item]]
+        # A shallow copy is enough: add appends to successor lists in place,
+        # and takes the append back if the graph turns out cyclic, while
+        # remove builds new lists.  Every vertex without successors shares
+        # the empty tuple.
+        return dict(self.edges)
+
+    def _members(self, bits):
+        """
+        Returns the vertices in the given bitset, in no particular order.
+        """
+        slots = self._slots
+        ret = []
+        while bits:
+            low = bits & -bits
+            ret.append(slots[low.bit_length() - 1])
+            bits ^= low
         return ret
 
+    def _index_vertex(self, v):
+        if v not in self._bits:
+            self._bits[v] = 1 << len(self._slots)
+            self._slots.append(v)
+            self._reach[v] = 0
+            self._reached[v] = 0
+
+    def _index_edge(self, v, w):
+        """
+        Folds the edge v -> w into the closure: every precursor of v, and v,
+        now reaches w and every successor of w.
+        """
+        bits = self._bits
+        reach = self._reach
+        reached = self._reached
+        below = bits[w] | reach[w]
+        above = bits[v] | reached[v]
+        for a in self._members(above):
+            reach[a] |= below
+        for d in self._members(below):
+            reached[d] |= above
+
+    def _reindex(self):
+        """
+        Rebuilds the closure index from scratch in O(V+E) bitset operations.
+        """
+        self._bits = {}
+        self._slots = []
+        self._reach = {}
+        self._reached = {}
+        self._position = dict((x, i) for i, x in enumerate(self.toporder))
+        for v in self.toporder:
+            self._index_vertex(v)
+        bits = self._bits
+        for v in reversed(self.toporder):
+            for w in self.edges[v]:
+                self._reach[v] |= bits[w] | self._reach[w]
+        for v in self.toporder:
+            for w in self.edges[v]:
+                self._reached[w] |= bits[v] | self._reached[v]
+
+    def reaches(self, v, w):
+        """
+        Returns True if there is a path from v to w, that is, if w
+        transitively depends on v.
+        """
+        if self.indexed:
+            return bool(self._reach[v] & self._bits[w])
+        return w in self.successors(v)
+
     def successors(self, vertex):
         """
         Returns a topologically ordered list of the successors
         for the given vertex.
         """
-        edges = self._edges_copy()
-        ret = []
+        if self.indexed:
+            return sorted(self._members(self._reach[vertex]), key=self._position.get)
+        edges = self.edges
+        ret = set()
         rem = set(edges[vertex])
         while len(rem) > 0:
             n = rem.pop()
-            ret.append(n)
+            ret.add(n)
             if n in edges:
                 for m in edges[n]:
                     rem.add(m)
@@ -54,16 +141,19 @@ class Graph(object):
         Returns a topologically ordered list of the precursors
         for the given vertex.
         """
-        edges = self._edges_copy()
-        ret = []
+        if self.indexed:
+            return sorted(self._members(self._reached[vertex]), key=self._position.get)
+        edges = self.edges
+        ret = set()
         rem = set([x for x in edges if vertex in edges[x]])
         while len(rem) > 0:
             n = rem.pop()
-            ret.append(n)
+            ret.add(n)
             for precursor in [m for m in edges if n in edges[m]]:
                 rem.add(precursor)
         return [x for x in self.toporder if x in ret]
-        
+
+
     def _toposort(self, graph):
         """
         Uses Khan (1962).  Runs in linear O(V+E) time.
@@ -92,41 +182,173 @@ class Graph(object):
         else:
             return ret
 
+    def _sort(self, edges):
+        counters = self.counters
+        if counters is None:
+            return self._toposort(edges)
+        begin = _clock()
+        ret = self._toposort(edges)
+        counters['toposort'] += 1
+        counters['toposort_seconds'] += _clock() - begin
+        return ret
+
     def add(self, v=None, w=None):
         if v is None and w is None:
             return self
+        counters = self.counters
+        begin = counters is not None and _clock()
 
         edges = self._edges_copy()
+        successors = None
         if v is not None and w is None:
             if v not in edges:
-                edges[v] = []
+                edges[v] = ()
         else:
-            if v not in edges:
-                edges[v] = [w]
-            else:
-                edges[v].append(w)
+            successors = edges.get(v) or []
+            successors.append(w)
+            edges[v] = successors
             if w not in edges:
-                edges[w] = []
+                edges[w] = ()
 
-        self.toporder = self._toposort(edges)
+        try:
+            self.toporder = self._sort(edges)
+        except Exception:
+            if successors is not None:
+                successors.pop()
+            raise
         self.edges = edges
+        if self.indexed:
+            self._position = dict((x, i) for i, x in enumerate(self.toporder))
+            self._index_vertex(v)
+            if w is not None:
+                self._index_vertex(w)
+                self._index_edge(v, w)
+        if counters is not None:
+            counters['add'] += 1
+            counters['add_seconds'] += _clock() - begin
         return self
     
     def remove(self, v):
         """
         Removes vertex from all edge relations.
         """
+        counters = self.counters
+        begin = counters is not None and _clock()
         edges = self._edges_copy()
         if v is not None:
             if v in edges:
                 del(edges[v])
             for edge in edges:
                 if v in edges[edge]:
-                    edges[edge].remove(v)
-        self.toporder = self._toposort(edges)
+                    edges[edge] = [x for x in edges[edge] if x != v] or ()
+        self.toporder = self._sort(edges)
         self.edges = edges
+        if self.indexed:
+            self._reindex()
+        if counters is not None:
+            counters['remove'] += 1
+            counters['remove_seconds'] += _clock() - begin
         return self
 
+    def ready_queue(self, vertices=None, reverse=False):
+        """
+        Returns a ReadyQueue over the given vertices, or over every vertex
+        if vertices is None.  If reverse is True, a vertex becomes ready
+        once all of its successors are done, rather than its precursors.
+        """
+        return ReadyQueue(self, vertices, reverse)
+
+
+class ReadyQueue(object):
+    """
+    Streams the vertices of a graph in dependency order.  get_ready hands
+    out every vertex whose precursors have all been marked done, and done
+    releases the vertices waiting on it.  The queue is a snapshot of the
+    graph taken at construction, and is safe to share between threads.
+    """
+    def __init__(self, graph, vertices=None, reverse=False):
+        if vertices is None:
+            vertices = graph.toporder
+        if reverse:
+            vertices = list(reversed(vertices))
+        members = set(vertices)
+        self._lock = threading.Condition()
+        self._waiting = {}
+        self._pending = {}
+        self._out = set()
+        for v in vertices:
+            self._waiting[v] = []
+            self._pending[v] = 0
+        for v in vertices:
+            for w in graph.edges[v]:
+                if w in members:
+                    first, then = (w, v) if reverse else (v, w)
+                    self._waiting[first].append(then)
+                    self._pending[then] += 1
+        self._ready = [v for v in vertices if self._pending[v] == 0]
+
+    def get_ready(self, limit=None):
+        """
+        Returns a tuple of the vertices that became ready since the last
+        call, or of the first limit of them, and marks them as handed out.
+        Never blocks.
+        """
+        with self._lock:
+            ret = tuple(self._ready[:limit])
+            self._ready = self._ready[len(ret):]
+            self._out.update(ret)
+            return ret
+
+    def wait(self, timeout=None, limit=None):
+        """
+        Blocks until some vertex is ready, or until nothing is left in
+        flight, then behaves like get_ready.
+        """
+        with self._lock:
+            if not self._ready and self._out:
+                self._lock.wait(timeout)
+            return self.get_ready(limit)
+
+    def done(self, *vertices):
+        """
+        Marks handed out vertices as finished, making ready any vertex whose
+        last outstanding precursor was among them.
+        """
+        with self._lock:
+            for v in vertices:
+                if v not in self._out:
+                    raise ValueError('Vertex %s was not handed out by get_ready.' % v)
+                self._out.remove(v)
+                for w in self._waiting[v]:
+                    self._pending[w] -= 1
+                    if self._pending[w] == 0:
+                        self._ready.append(w)
+            self._lock.notify_all()
+
+    def abandon(self, *vertices):
+        """
+        Marks handed out vertices as finished without releasing the
+        vertices waiting on them, which are then never handed out.
+        """
+        with self._lock:
+            for v in vertices:
+                if v not in self._out:
+                    raise ValueError('Vertex %s was not handed out by get_ready.' % v)
+                self._out.remove(v)
+            self._lock.notify_all()
+
+    def is_active(self):
+        """
+        Returns True while some vertex is ready or handed out and not done.
+        Vertices held back by a precursor that is never marked done do not
+        keep the queue active.
+        """
+        with self._lock:
+            return bool(self._ready or self._out)
+
+    __nonzero__ = is_active
+    __bool__ = is_active
+
 
 if __name__ == '__main__':
   import unittest
@@ -160,6 +382,9 @@ if __name__ == '__main__':
           g.add(d, a)
           self.assertEqual(4, len(g.vertices()))
           self.assertRaises(Exception, g.add, c, d)
+          # The rejected edge leaves no trace.
+          self.assertEqual([], g.successors(c))
+          self.assertEqual([a], g.edges[d])
 
       def testGetPrecursorNodes(self):
           g = Graph()
@@ -186,6 +411,101 @@ if __name__ == '__main__':
           self.assertEqual(['a','b','c','d'], g.toporder)
           g.remove('c')
           self.assertEqual(['a','b','d'], g.toporder)
+          self.assertEqual(['b'], g.edges['a'])
+          self.assertEqual((), g.edges['b'])
+
+      def testReachabilityIndex(self):
+          g = Graph(indexed=True)
+          g.add('c','d')
+          g.add('b','c')
+          g.add('a','b')
+          g.add('a','d')
+          g.add('e')
+          self.assertEqual(['b','c','d'], g.successors('a'))
+          self.assertEqual(['a','b','c'], g.precursors('d'))
+          self.assertTrue(g.reaches('a','d'))
+          self.assertFalse(g.reaches('d','a'))
+          self.assertFalse(g.reaches('a','e'))
+          self.assertEqual([], g.successors('e'))
+          self.assertRaises(Exception, g.add, 'd', 'a')
+          # Removing a vertex breaks the paths through it.
+          g.remove('c')
+          self.assertFalse(g.reaches('b','d'))
+          self.assertTrue(g.reaches('a','d'))
+          # b and d no longer depend on one another, so either may come first.
+          self.assertEqual(set(['b','d']), set(g.successors('a')))
+          self.assertEqual(['a'], g.precursors('d'))
+
+      def testCounters(self):
+          g = Graph(counters=True)
+          g.add('a','b')
+          g.add('b','c')
+          g.remove('c')
+          self.assertEqual(2, g.counters['add'])
+          self.assertEqual(1, g.counters['remove'])
+          self.assertEqual(3, g.counters['toposort'])
+          self.assertTrue(g.counters['add_seconds'] >= 0)
+          g.counters = None
+          g.add('c')
+          self.assertEqual(['a','b','c'], sorted(g.toporder))
+
+      def testReadyQueue(self):
+          g = Graph()
+          g.add('a','b')
+          g.add('a','c')
+          g.add('b','d')
+          g.add('c','d')
+          q = g.ready_queue()
+          self.assertEqual(('a',), q.get_ready())
+          self.assertEqual((), q.get_ready())
+          self.assertRaises(ValueError, q.done, 'b')
+          q.done('a')
+          b_or_c = q.get_ready(1)
+          self.assertEqual(1, len(b_or_c))
+          self.assertEqual(set(['b','c']), set(b_or_c + q.get_ready()))
+          q.done('b')
+          self.assertEqual((), q.get_ready())
+          q.done('c')
+          self.assertEqual(('d',), q.get_ready())
+          self.assertTrue(q.is_active())
+          q.done('d')
+          self.assertFalse(q.is_active())
+
+          # Descending order, restricted to a subgraph.
+          q = g.ready_queue(['a','b','d'], reverse=True)
+          order = []
+          while q.is_active():
+              for v in q.get_ready():
+                  order.append(v)
+                  q.done(v)
+          self.assertEqual(['d','b','a'], order)
+
+          # Vertices behind one that never finishes are held back.
+          q = g.ready_queue()
+          q.get_ready()
+          self.assertTrue(q.is_active())
+          self.assertEqual((), q.wait(0.01))
+          q.abandon('a')
+          self.assertFalse(q.is_active())
+          self.assertEqual((), q.wait())
+
+      def testReadyQueueThreads(self):
+          g = Graph()
+          for i in range(10):
+              g.add(i, i + 1)
+          q = g.ready_queue()
+          order = []
+          def work():
+              while q.is_active():
+                  for v in q.wait(0.1):
+                      order.append(v)
+                      q.done(v)
+          workers = [threading.Thread(target=work) for i in range(4)]
+          for t in workers:
+              t.start()
+          for t in workers:
+              t.join()
+          self.assertEqual(list(range(11)), order)
 
 
   unittest.main()
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+'''
+    pycoasync
+    ---------
+
+    This module provides asynchronous instantiation for pycocontainer.
+    It is kept apart from the container itself because it needs Python 3.5
+    or later.  Use it through Pycocontainer.ainstance_of.
+
+    :copyright: (c) 2013 by Alexander R. Saint Croix.
+    :license: ASL v2.0, see LICENSE for more details.
+'''
+
+__all__ = ['ainstance_of']
+
+import asyncio
+import inspect
+
+from pycocontainer import CircularDependency, _clock, _defaults
+
+async def ainstance_of(container, cls, name, hints):
+    """
+    Builds the instance named name, and any of its missing dependencies,
+    and hands it out, bringing it up if the container is lazy.  Existing
+    instances and memoized factory products are handed out by instance_of.
+    """
+    if name in container._instance_registry or container._cached(cls, hints) is not None:
+        return container.instance_of(cls, name, hints)
+    instance = await _ainstantiate(container, cls, name, hints, (name,))
+    # Counted like a cold instance_of: a lookup, but not a hit.
+    container._tally('instance_of')
+    if container.lazy:
+        node = container._instance_nodes[name]
+        container._owner(node)._bring_up(node)
+    return instance
+
+async def _ainstantiate(container, cls, name, hints, processing):
+    """
+    Returns the instance named name, building it unless it exists or is
+    already being built, in which case the existing build is awaited.
+    """
+    pending = container._pending
+    waits = container._waits
+    waiter = processing[-2] if len(processing) > 1 else None
+    if name in pending:
+        # Another caller's build may itself be waiting on this one.
+        if waiter is not None and _waits_on(waits, name, waiter):
+            raise CircularDependency()
+        future = pending[name]
+    elif name in container._instance_registry:
+        return container._instance_registry[name]
+    else:
+        future = asyncio.ensure_future(_build(container, cls, name, hints, processing))
+        pending[name] = future
+        # The build outlives callers that are cancelled, so it clears up after itself.
+        future.add_done_callback(lambda x: pending.pop(name, None) if pending.get(name) is x else None)
+    if waiter is None:
+        return await asyncio.shield(future)
+    waits.setdefault(waiter, set()).add(name)
+    try:
+        return await asyncio.shield(future)
+    finally:
+        waits[waiter].discard(name)
+        if not waits[waiter]:
+            del waits[waiter]
+
+def _waits_on(waits, name, other):
+    """
+    Returns whether the pending build of name waits, directly or through
+    other pending builds, on the build of other.
+    """
+    seen, stack = set(), [name]
+    while stack:
+        current = stack.pop()
+        if current == other:
+            return True
+        if current not in seen:
+            seen.add(current)
+            stack.extend(waits.get(current, ()))
+    return False
+
+async def _build(container, cls, name, hints, processing):
+    container._tally('instantiate', len(processing))
+    tracer = container._tracer
+    begin = _clock()
+    components = container._component_registry
+    if cls not in components:
+        container.register(cls, name)
+    component = components[cls]
+    deps, wanted = container._plan(cls, component.varnames, _defaults(cls), hints)
+    for vname, cl in wanted:
+        if vname in processing:
+            raise CircularDependency()
+    # Siblings are built concurrently.
+    built = await asyncio.gather(*[
+        _ainstantiate(container, cl, vname, hints, processing + (vname,))
+        for vname, cl in wanted])
+    deps.update(zip([vname for vname, cl in wanted], built))
+
+    instance = container._construct(cls, deps, asynchronous=True)
+    if inspect.isawaitable(instance):
+        instance = await instance
+    ainit = getattr(type(instance), 'ainit', None)
+    if ainit is not None:
+        await ainit(instance)
+    container._install(name, cls, instance, deps, hints)
+    container._memoize(cls, name, hints)
+    if tracer is not None:
+        # One track per task, so concurrent builds show side by side.
+        tracer.record('instantiate', name, begin, _clock(), id(asyncio.current_task()
+            if hasattr(asyncio, 'current_task') else asyncio.Task.current_task()))
+    return instance
+
+
+if __name__ == '__main__':
+    import time
+    import unittest
+    from pycocontainer import AsynchronousComponent, Cache, Pycocontainer
+
+    def run(coroutine):
+        if hasattr(asyncio, 'run'):
+            return asyncio.run(coroutine)
+        return asyncio.get_event_loop().run_until_complete(coroutine)
+
+    class TestAsyncInstantiation(unittest.TestCase):
+
+        def setUp(self):
+            self.pyco = Pycocontainer('Async container')
+            self.log = []
+
+        def testSiblingsBuildConcurrently(self):
+            log = self.log
+            async def left():
+                log.append('left')
+                await asyncio.sleep(0.01)
+                log.append('left done')
+                return 'L'
+            async def right():
+                log.append('right')
+                await asyncio.sleep(0.01)
+                log.append('right done')
+                return 'R'
+            def both(left, right):
+                return (left, right)
+            pyco = self.pyco
+            pyco.register_factory(left, 'left')
+            pyco.register_factory(right, 'right')
+            pyco.register_factory(both, 'both')
+            tracer = pyco.trace()
+            pyco.count()
+            self.assertEqual(('L', 'R'), run(pyco.ainstance_of(both, 'both')))
+            self.assertEqual(3, pyco.stats()['counters']['instantiate'])
+            self.assertEqual(2, pyco.stats()['counters']['max_depth'])
+            self.assertEqual(1, pyco.stats()['counters']['instance_of'])
+            self.assertNotIn('instance_of_hits', pyco.stats()['counters'])
+            self.assertEqual(('L', 'R'), run(pyco.ainstance_of(both, 'both')))
+            self.assertEqual(1, pyco.stats()['counters']['instance_of_hits'])
+            self.assertEqual(['left', 'right'], sorted(log[:2]))
+            self.assertEqual('L', pyco.get('left'))
+            # Each build shows on the track of its own task.
+            tids = dict((name, tid) for _, name, _, _, tid in tracer.events())
+            self.assertEqual(['both', 'left', 'right'], sorted(tids))
+            self.assertEqual(3, len(set(tids.values())))
+
+        def testBuiltOnce(self):
+            log = self.log
+            class Model(object):
+                def __init__(self):
+                    log.append('init')
+                async def ainit(self):
+                    await asyncio.sleep(0.01)
+                    log.append('ainit')
+            class Scorer(object):
+                def __init__(self, model):
+                    self.model = model
+            pyco = self.pyco
+            pyco.register(Model, 'model')
+            pyco.register(Scorer, 'scorer')
+            async def together():
+                return await asyncio.gather(
+                    pyco.ainstance_of(Scorer, 'scorer'),
+                    pyco.ainstance_of(Scorer, 'scorer'),
+                    pyco.ainstance_of(Model, 'model'))
+            a, b, c = run(together())
+            self.assertIs(a, b)
+            self.assertIs(a.model, c)
+            self.assertEqual(['init', 'ainit'], log)
+            self.assertEqual([c, a], pyco._instance_graph.toporder)
+            self.assertEqual({}, pyco._pending)
+
+        def testSynchronousPathsRefuse(self):
+            async def make():
+                return 'M'
+            class Model(object):
+                async def ainit(self):
+                    pass
+            pyco = self.pyco
+            pyco.register_factory(make, 'make', cache=Cache(ttl=0.01))
+            pyco.register(Model, 'model')
+            self.assertRaises(AsynchronousComponent, pyco.instance_of, make, 'make')
+            self.assertRaises(AsynchronousComponent, pyco.instance_of, Model, 'model')
+            self.assertEqual([], pyco._instance_graph.toporder)
+            self.assertEqual('M', run(pyco.ainstance_of(make, 'make')))
+            model = run(pyco.ainstance_of(Model, 'model'))
+            # Rebuilding synchronously is refused, and the instance is kept.
+            time.sleep(0.02)
+            self.assertRaises(AsynchronousComponent, pyco.get, 'make')
+            self.assertEqual('M', pyco._instance_registry['make'])
+            self.assertRaises(AsynchronousComponent, pyco.replace, 'model')
+            self.assertIs(model, pyco.get('model'))
+
+        def testCancelledCaller(self):
+            async def slow():
+                await asyncio.sleep(0.05)
+                return 'S'
+            pyco = self.pyco
+            pyco.register_factory(slow, 'slow')
+            async def cancel():
+                caller = asyncio.ensure_future(pyco.ainstance_of(slow, 'slow'))
+                await asyncio.sleep(0.01)
+                caller.cancel()
+                # The build carries on without the caller.
+                await asyncio.sleep(0.1)
+                return dict(pyco._pending)
+            self.assertEqual({}, run(cancel()))
+            self.assertEqual('S', pyco.get('slow'))
+
+        def testCircularDependency(self):
+            class C(object):
+                def __init__(self, d): pass
+            class D(object):
+                def __init__(self, c): pass
+            pyco = self.pyco
+            pyco.register(C, 'c')
+            pyco.register(D, 'd')
+            self.assertRaises(CircularDependency, run, pyco.ainstance_of(C, 'c'))
+
+        def testConcurrentCircularDependency(self):
+            class C(object):
+                def __init__(self, d): pass
+            class D(object):
+                def __init__(self, c): pass
+            pyco = self.pyco
+            pyco.register(C, 'c')
+            pyco.register(D, 'd')
+            async def both():
+                return await asyncio.wait_for(asyncio.gather(
+                    pyco.ainstance_of(C, 'c'), pyco.ainstance_of(D, 'd'),
+                    return_exceptions=True), 5)
+            for result in run(both()):
+                self.assertTrue(isinstance(result, CircularDependency))
+            self.assertEqual({}, pyco._pending)
+            self.assertEqual({}, pyco._waits)
+
+
+    unittest.main()
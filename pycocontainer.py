@@ -17,8 +17,26 @@ __author__ = 'Alexander R. Saint Croix'
 __license__ = 'Apache Software License v2.0'
 __copyright__ = '(c) 2013 by Alexander R. Saint Croix'
 
+from collections import Counter, OrderedDict
 from enum import Enum
+import cProfile
+import fnmatch
 import inspect
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import threading
+import time
+import weakref
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+_clock = getattr(time, 'perf_counter', time.time)
 
 class DuplicateComponentClass(Exception):
     def __init__(self, msg):
@@ -38,6 +56,10 @@ class UnsatisfiableDependency(Exception):
 
 class CircularDependency(Exception): pass
 
+class AsynchronousComponent(Exception):
+    def __init__(self, msg):
+        super(AsynchronousComponent, self).__init__(msg)
+
 class NotImplemented(Exception):
     def __init__(self, msg):
         super(NotImplemented, self).__init__(msg)
@@ -75,10 +97,12 @@ def failmethod(func):
         self.failed()
     return fail
 
-class Lifecycle(object):
-    def __init__(self):
-        super(Lifecycle, self).__init__()
-        self.stage = Stage.stopped
+class _Staged(object):
+    """
+    The stage transitions shared by Lifecycle and SlottedLifecycle.  No
+    slots of its own, so it lays out alongside any other base class.
+    """
+    __slots__ = ()
 
     def starting(self): self.stage = Stage.starting
     def started(self): self.stage = Stage.started
@@ -87,55 +111,440 @@ class Lifecycle(object):
     def failing(self): self.stage = Stage.failing
     def failed(self): self.stage = Stage.failed
 
-class LifecycleContainer(Lifecycle):
+class Lifecycle(_Staged):
+    def __init__(self):
+        super(Lifecycle, self).__init__()
+        self.stage = Stage.stopped
+
+class SlottedLifecycle(_Staged):
+    """
+    Lifecycle with the stage in a slot, so subclasses that declare
+    __slots__ for their own attributes too carry no instance __dict__,
+    which adds up in containers holding components by the hundred
+    thousand.  Being slotted, it can't share a class with bases that have
+    an instance layout of their own, such as dict or Exception; use
+    Lifecycle there.
+    """
+    __slots__ = ('stage',)
+
+    def __init__(self):
+        super(SlottedLifecycle, self).__init__()
+        self.stage = Stage.stopped
+
+class RetryPolicy(object):
+    """
+    How many times, and how patiently, the container retries starting a
+    component.  The n-th retry waits backoff * factor ** (n - 1) seconds,
+    give or take a random jitter fraction of that, and no retry is made
+    that would end past deadline seconds after the first attempt.
+    """
+    def __init__(self, attempts=3, backoff=0.1, factor=2.0, jitter=0.1, deadline=None):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.factor = factor
+        self.jitter = jitter
+        self.deadline = deadline
+
+    def delay(self, attempt):
+        delay = self.backoff * self.factor ** (attempt - 1)
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+class Readiness(object):
+    """
+    Resolves once a component started in the background has reached
+    Stage.started, or has failed to.
+    """
     def __init__(self):
+        self._event = threading.Event()
+        self.error = None
+
+    def _resolve(self, error=None):
+        self.error = error
+        self._event.set()
+
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until resolved, or until timeout seconds have passed.
+        Returns True if the component started, and False on timeout.
+        If the component failed to start, raises the reason.
+        """
+        if not self._event.wait(timeout):
+            return False
+        if self.error is not None:
+            raise self.error
+        return True
+
+class Tracer(object):
+    """
+    Records timed spans into a buffer preallocated for capacity events, so
+    that recording allocates nothing but the event tuple itself.  Events
+    past capacity are dropped, and counted in dropped.
+    """
+    def __init__(self, capacity=65536):
+        self._events = [None] * capacity
+        self._next = itertools.count()
+        self.dropped = 0
+
+    def record(self, category, name, begin, end, tid=None):
+        i = next(self._next)
+        if i >= len(self._events):
+            self.dropped += 1
+            return
+        if tid is None:
+            tid = threading.current_thread().ident
+        self._events[i] = (category, name, begin, end, tid)
+
+    def events(self):
+        return [x for x in self._events if x is not None]
+
+class LifecycleContainer(Lifecycle):
+    def __init__(self, indexed=False, counters=False):
         from dag import Graph
         super(LifecycleContainer, self).__init__()
-        self._instance_graph = Graph()
+        self._instance_graph = Graph(indexed)
+        # Counter of container events, while counting
+        self._counters = None
+        self._counter_lock = threading.Lock()
+        self.count(counters)
+        # node -> Readiness, for nodes started by start_background
+        self._readiness = {}
+        # (directory, name patterns) while profiling transitions
+        self._profiling = None
+        self._profile_lock = threading.Lock()
+        # Tracer, while tracing
+        self._tracer = None
 
-    def start(self, instance=None):
+    def _name_of(self, node):
         """
-        Starts the instance, and its dependencies, in order.
-        If instance is None, starts every instance in the backing DAG.
-        If any of the instances are not startable, raises exceptions.
+        Returns the name node goes by in profiles and traces.
+        """
+        return node.__class__.__name__
+
+    def _aliases_of(self, node):
+        """
+        Returns the other names profile patterns may select node by.
+        """
+        return ()
+
+    def count(self, enabled=True):
+        """
+        Turns the counters of the container and its backing DAG on, from
+        zero, or entirely off.  They are cheap enough to leave on.
+        """
+        self._counters = Counter() if enabled else None
+        self._instance_graph.counters = Counter() if enabled else None
+
+    def _tally(self, key, depth=None):
         """
-        def _start_node(node):
+        Counts one more key event, if counting, and if depth is given, keeps
+        the deepest depth one came at in max_depth.  Transitions run on
+        several threads at once, so the counters are updated under a lock.
+        """
+        counters = self._counters
+        if counters is None:
+            return
+        with self._counter_lock:
+            counters[key] += 1
+            if depth is not None:
+                counters['max_depth'] = max(counters['max_depth'], depth)
+
+    def stats(self):
+        """
+        Returns a snapshot of the size and state of the container, along
+        with its counters, which are None unless counting.
+        """
+        dag = self._instance_graph
+        with self._counter_lock:
+            counters = None if self._counters is None else dict(self._counters)
+        stages = Counter()
+        for node in dag.toporder:
+            stage = getattr(node, 'stage', None)
+            if stage is not None:
+                stages[stage.name] += 1
+        return {
+            'vertices': len(dag.toporder),
+            'edges': sum(len(x) for x in dag.edges.values()),
+            'stages': dict(stages),
+            'counters': counters,
+            'graph': None if dag.counters is None else dict(dag.counters),
+        }
+
+    def profile(self, directory, *patterns):
+        """
+        Profiles the start, stop and fail transitions of the components
+        whose instance or component names match any of the glob patterns,
+        or of every component if no pattern is given.  Each transition leaves a pstats file, and
+        where tracemalloc is available, a listing of its top allocation
+        sites, in directory.  profile(None) turns profiling off again.
+        Profiled transitions run one at a time.
+        """
+        if directory is None:
+            self._profiling = None
+            return
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._profiling = (directory, patterns or ('*',))
+
+    def trace(self, capacity=65536):
+        """
+        Starts recording the start, stop and fail transitions of every node,
+        and in a Pycocontainer every instantiation, into a fresh Tracer
+        holding up to capacity events, and returns it.  trace(None) stops
+        recording and discards the events, so export them first.
+        """
+        self._tracer = None if capacity is None else Tracer(capacity)
+        return self._tracer
+
+    def export_trace(self, out):
+        """
+        Writes the recorded events to out, a path or a file, in the Chrome
+        trace event format, ready to be opened in a trace viewer.  Each
+        event lists the names its node depends on in the backing DAG.
+        Raises LifecycleException unless tracing.
+        """
+        tracer = self._tracer
+        if tracer is None:
+            raise LifecycleException('Nothing to export: tracing is off.  Call trace first.')
+        dag = self._instance_graph
+        depends = {}
+        for v in dag.toporder:
+            for w in dag.edges[v]:
+                depends.setdefault(self._name_of(w), []).append(self._name_of(v))
+        pid = os.getpid()
+        events = [{
+            'name': str(name), 'cat': category, 'ph': 'X', 'pid': pid, 'tid': tid,
+            'ts': begin * 1e6, 'dur': (end - begin) * 1e6,
+            'args': {'depends_on': depends.get(name, [])},
+        } for category, name, begin, end, tid in tracer.events()]
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        if hasattr(out, 'write'):
+            json.dump(trace, out)
+        else:
+            with open(out, 'w') as f:
+                json.dump(trace, f)
+
+    def _invoke(self, node, op):
+        """
+        Calls the lifecycle method op of node, recording it if tracing.
+        """
+        self._tally(op)
+        tracer = self._tracer
+        if tracer is None:
+            return self._call(node, op)
+        begin = _clock()
+        try:
+            return self._call(node, op)
+        finally:
+            tracer.record(op, self._name_of(node), begin, _clock())
+
+    def _call(self, node, op, top=25):
+        """
+        Calls the lifecycle method op of node, under the profilers if it is
+        selected by profile.
+        """
+        profiling = self._profiling
+        name = profiling and self._name_of(node)
+        if profiling is None or not [x for x in profiling[1] for y in (name,) + tuple(self._aliases_of(node))
+                                     if fnmatch.fnmatchcase(y, x)]:
+            return getattr(node, op)()
+
+        base = os.path.join(profiling[0], '%s.%s' % (str(name).replace(os.sep, '_'), op))
+        profiler = cProfile.Profile()
+        with self._profile_lock:
+            tracing = tracemalloc is not None and not tracemalloc.is_tracing()
+            if tracing:
+                tracemalloc.start()
+            before = tracemalloc.take_snapshot() if tracemalloc is not None else None
+            try:
+                profiler.runcall(getattr(node, op))
+            finally:
+                profiler.dump_stats(base + '.pstats')
+                if before is not None:
+                    after = tracemalloc.take_snapshot()
+                    with open(base + '.alloc.txt', 'w') as out:
+                        for stat in after.compare_to(before, 'lineno')[:top]:
+                            out.write('%s\n' % stat)
+                if tracing:
+                    tracemalloc.stop()
+
+    def _retry_policy(self, node):
+        """
+        Returns the RetryPolicy for starting node, or None to fail at once.
+        """
+        return None
+
+    def _start_node(self, node):
+        if not hasattr(node, 'stage'):
+            # Not lifecycle managed, only ordered.
+            return
+        policy = self._retry_policy(node)
+        if policy is None or node.stage in [Stage.started, Stage.starting]:
             if node.stage not in [Stage.started, Stage.starting]:
-                node.start()
+                self._invoke(node, 'start')
             if node.stage is not Stage.started:
                 raise LifecycleException('Could not properly start node %s' % node)
+            return
+
+        begun = _clock()
+        attempt = 0
+        last = None
+        while node.stage is not Stage.started:
+            if attempt > 0:
+                delay = policy.delay(attempt)
+                if attempt >= policy.attempts or (policy.deadline is not None and
+                        _clock() + delay - begun > policy.deadline):
+                    # Out of retries: leave the node failed rather than starting.
+                    node.stage = Stage.failed
+                    error = LifecycleException('Could not properly start node %s after %s attempts%s'
+                                               % (node, attempt, '' if last is None else ': %r' % last))
+                    error.__cause__ = last
+                    raise error
+                time.sleep(delay)
+            attempt += 1
+            try:
+                self._invoke(node, 'start')
+            except Exception as e:
+                last = e
+
+    def _stop_node(self, node):
+        if not hasattr(node, 'stage'):
+            return
+        if node.stage not in [Stage.stopped, Stage.stopping]:
+            self._invoke(node, 'stop')
+        if node.stage is not Stage.stopped:
+            raise LifecycleException('Could not properly stop node %s' % node)
+
+    def _fail_node(self, node):
+        if not hasattr(node, 'stage'):
+            return
+        self._invoke(node, 'fail')
+        if node.stage is not Stage.failed:
+            raise LifecycleException('Could not properly fail node %s' % node)
 
+    def _drive(self, queue, transition, concurrent=lambda node: False, workers=None):
+        """
+        Applies transition to every vertex of a ReadyQueue, as it becomes ready.
+        Vertices for which concurrent is true get a thread of their own, so
+        that while they take their time, unrelated branches keep moving.
+        If workers is given instead, that many threads take ready vertices
+        one at a time, until there are none left.
+        When a transition fails, only the vertices waiting on it are held
+        back.  The first failure is raised once everything else is done.
+        """
+        failures = []
+        threads = []
+        def run(node):
+            try:
+                transition(node)
+            except Exception as e:
+                failures.append(e)
+                queue.abandon(node)
+            else:
+                queue.done(node)
+
+        def work():
+            while queue.is_active():
+                for node in queue.wait(limit=1):
+                    run(node)
+
+        if workers is not None:
+            for i in range(workers):
+                thread = threading.Thread(target=work)
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        while workers is None and queue.is_active():
+            for node in queue.wait():
+                if concurrent(node):
+                    thread = threading.Thread(target=run, args=(node,))
+                    thread.daemon = True
+                    thread.start()
+                    threads.append(thread)
+                else:
+                    run(node)
+        for thread in threads:
+            thread.join()
+        if len(failures) > 0:
+            raise failures[0]
+
+    def start(self, instance=None):
+        """
+        Starts the instance, and its dependencies, in order.
+        If instance is None, starts every instance in the backing DAG.
+        If any of the instances are not startable, raises exceptions.
+        """
         dag = self._instance_graph
         self.starting()
         if instance is None:
             # Start every startable component in the container in ascending order.
-            for node in dag.toporder:
-                _start_node(node)
+            self._drive(dag.ready_queue(), self._start_node, self._retry_policy)
         else:
-            # Start this component's precursors, in ascending order
-            precursors = dag.precursors(instance)
-            for prec in precursors:
-                _start_node(prec)
-
-            # Start this component.
-            _start_node(instance)
+            # Start this component's precursors, then this component, in ascending order
+            self._drive(dag.ready_queue(dag.precursors(instance) + [instance]),
+                        self._start_node, self._retry_policy)
 
         self.started()
 
 
-    def stop(self, instance=None):
-        def _stop_node(node):
-            if node.stage not in [Stage.stopped, Stage.stopping]:
-                node.stop()
-            if node.stage is not Stage.stopped:
-                raise LifecycleException('Could not properly stop node %s' % node)
+    def _start_upstream(self, node):
+        """
+        Starts whatever node depends on outside the backing DAG, which is
+        nothing, unless this is a child container.
+        """
+
+    def start_background(self, instance=None, workers=8):
+        """
+        Like start, but returns at once, leaving the starting to a pool of
+        workers background threads, each taking nodes one at a time as they
+        become ready, so a slow component holds back nothing but its own
+        dependents and a worker.  Each node being started gets a Readiness,
+        and the returned Readiness resolves once the whole run is over.
+        """
+        dag = self._instance_graph
+        nodes = dag.toporder if instance is None else dag.precursors(instance) + [instance]
+        readiness = dict((node, Readiness()) for node in nodes)
+        self._readiness.update(readiness)
+        overall = Readiness()
+
+        def transition(node):
+            try:
+                self._start_upstream(node)
+                self._start_node(node)
+            except Exception as e:
+                readiness[node]._resolve(e)
+                raise
+            readiness[node]._resolve()
+
+        def run():
+            error = None
+            try:
+                self._drive(dag.ready_queue(nodes), transition, workers=workers)
+            except Exception as e:
+                error = e
+            else:
+                self.started()
+            for node in nodes:
+                if not readiness[node].done():
+                    readiness[node]._resolve(LifecycleException(
+                        'Node %s was held back by a precursor that failed to start' % node))
+            overall._resolve(error)
 
+        self.starting()
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return overall
+
+
+    def stop(self, instance=None):
         dag = self._instance_graph
         if instance is None:
             self.stopping() # Down with the ship.
             # Stop every startable component in the container in descending order.
-            for node in list(reversed(dag.toporder)):
-                _stop_node(node)
+            self._drive(dag.ready_queue(reverse=True), self._stop_node)
             self.stopped()
         else:
             descendants = dag.successors(instance)
@@ -144,10 +553,10 @@ class LifecycleContainer(Lifecycle):
                 self.stopping()
             # Stop every startable component that depends on this component, in descending order.
             for descendant in list(reversed(descendants)):
-                _stop_node(descendant)
+                self._stop_node(descendant)
 
             # Stop this component.
-            _stop_node(instance)
+            self._stop_node(instance)
             if covered:
                 self.stopped()
 
@@ -175,10 +584,7 @@ class LifecycleContainer(Lifecycle):
         if instance is None:
             self.failing() # Down with the ship.
             # Fail every startable component in the container in descending order.
-            for node in list(reversed(dag.toporder)):
-                node.fail()
-                if node.stage is not Stage.failed:
-                    raise LifecycleException('Could not properly fail node %s' % node)
+            self._drive(dag.ready_queue(reverse=True), self._fail_node)
             self.failed()
         else:
             descendants = dag.successors(instance)
@@ -186,56 +592,509 @@ class LifecycleContainer(Lifecycle):
             if covered:
                 self.failing() # If all else fails, well, we do too.
             for descendant in list(reversed(descendants)):
-                descendant.fail()
-                if descendant.stage is not Stage.failed:
-                    raise LifecycleException('Could not properly fail node %s' % node)
+                self._fail_node(descendant)
             # Fail this component.
-            instance.fail()
-            if instance.stage is not Stage.failed:
-                raise LifecycleException('Could not properly fail node %s' % instance)
+            self._fail_node(instance)
             if covered:
                 self.failed()
 
 
+class Cache(object):
+    """
+    How a container memoizes the products of a factory registered with
+    register_factory.  Products are keyed by the hints given for the
+    factory's own parameters, and a product asked for again under another
+    name is registered under that name too, as an alias.  If ttl is set,
+    a product older than ttl seconds is rebuilt, along with its
+    dependents, the next time it is asked for.  If size is set, at most
+    size products are kept, and the least recently used ones that nothing
+    depends on are dropped.  By default, products are kept for the life
+    of the container.
+    """
+    def __init__(self, ttl=None, size=None):
+        self.ttl = ttl
+        self.size = size
+
+def _hint_key(hints, varnames):
+    """
+    Returns the key a factory product is memoized under: the hints for the
+    factory's own parameters, leaving out any meant for other components.
+    """
+    return tuple(sorted((k, v) for k, v in hints.items() if k in varnames))
+
+class _Shared(object):
+    """
+    Placeholder for a payload passed through the shared buffer of a
+    ProcessProxy rather than pickled through its pipe.
+    """
+    def __init__(self, size):
+        self.size = size
+
+def _pack(values, buf, threshold):
+    """
+    Moves the first large byte string in values into the shared buffer.
+    Everything else is left to be pickled.
+    """
+    ret = list(values)
+    for i, value in enumerate(ret):
+        if isinstance(value, bytes) and threshold <= len(value) <= len(buf):
+            buf[:len(value)] = value
+            ret[i] = _Shared(len(value))
+            break
+    return ret
+
+def _unpack(values, buf):
+    return [buf[:x.size] if isinstance(x, _Shared) else x for x in values]
+
+def _serve(cls, deps, conn, buf, threshold):
+    """
+    Worker process loop: builds the component and runs the operations the
+    proxy sends, until the component is stopped or failed.
+    """
+    # Unless the worker was forked, cls was imported afresh, without the
+    # bindings register made in the container's process.
+    for klass in reversed(cls.__mro__):
+        _bind_lifecycle(klass)
+    try:
+        instance = cls(**deps)
+    except Exception as e:
+        instance = e
+    while True:
+        op, args, kwargs = conn.recv()
+        try:
+            if isinstance(instance, Exception):
+                raise instance
+            args = _unpack(args, buf)
+            if op in ['start', 'stop', 'fail']:
+                if hasattr(instance, op):
+                    getattr(instance, op)()
+                ret = getattr(instance, 'stage', None)
+            else:
+                ret = getattr(instance, op)(*args, **kwargs)
+            conn.send(('ok', _pack([ret], buf, threshold)))
+        except Exception as e:
+            try:
+                conn.send(('error', e))
+            except Exception:
+                conn.send(('error', Exception(repr(e))))
+        if op in ['stop', 'fail']:
+            break
+    conn.close()
+
+
+class ProcessProxy(Lifecycle):
+    """
+    Stands in for a component that runs inside its own worker process, so
+    CPU-bound work does not compete with the container's process for the
+    GIL.  The worker is started, and the component built in it, when the
+    proxy starts.  It exits once the component is stopped or failed.  Any
+    multiprocessing start method will do, as long as the component class
+    can be imported by name in the worker.
+
+    Method calls are forwarded over a local pipe.  Byte strings of at least
+    threshold bytes, up to buffer_size, are copied through a shared memory
+    buffer instead of being pickled.  Constructor arguments are copied
+    into the worker, so dependencies are not shared with the container.
+    """
+    def __init__(self, cls, deps, buffer_size=1 << 20, threshold=1 << 16):
+        super(ProcessProxy, self).__init__()
+        self.target = cls
+        self._deps = deps
+        self._threshold = threshold
+        self._buffer = multiprocessing.RawArray('c', buffer_size)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._process = None
+
+    def _call(self, op, args=(), kwargs={}):
+        with self._lock:
+            if self._conn is None:
+                raise LifecycleException('%s is not running in a worker process.' % self.target)
+            self._conn.send((op, _pack(args, self._buffer, self._threshold), kwargs))
+            status, ret = self._conn.recv()
+            if status == 'error':
+                raise ret
+            return _unpack(ret, self._buffer)[0]
+
+    def _close(self):
+        self._conn.close()
+        self._conn = None
+        self._process.join()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        def remote(*args, **kwargs):
+            return self._call(name, args, kwargs)
+        return remote
+
+    def start(self):
+        self.starting()
+        conn, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve, args=(
+            self.target, self._deps, child, self._buffer, self._threshold))
+        self._process.daemon = True
+        self._process.start()
+        child.close()
+        self._conn = conn
+        try:
+            stage = self._call('start')
+        except Exception:
+            self._process.terminate()
+            self._close()
+            self.failed()
+            raise
+        self.stage = stage or Stage.started
+
+    def stop(self):
+        self.stopping()
+        stage = None
+        if self._conn is not None:
+            try:
+                stage = self._call('stop')
+            finally:
+                self._close()
+        self.stage = stage or Stage.stopped
+
+    def fail(self):
+        self.failing()
+        stage = None
+        if self._conn is not None:
+            try:
+                stage = self._call('fail')
+            finally:
+                self._close()
+        self.stage = stage or Stage.failed
+
+
+def _bind_lifecycle(cls):
+    """
+    Binds the methods of cls decorated with startmethod, stopmethod or
+    failmethod to its start, stop and fail attributes.
+    """
+    # If the class has a function named 'start', bind it to 'start' attribute.
+    member = cls.__dict__
+    funcs = [member[arg] for arg in member.keys() if (
+        member[arg].__class__.__name__ == 'function')]
+    target = [f for f in funcs if f.__name__ == 'start']
+    if len(target) > 0:
+        cls.start = target[0]
+    target = [f for f in funcs if f.__name__ == 'stop']
+    if len(target) > 0:
+        cls.stop = target[0]
+    target = [f for f in funcs if f.__name__ == 'fail']
+    if len(target) > 0:
+        cls.fail = target[0]
+
+def _default_args(func):
+    args, varargs, keywords, defaults = inspect.getargspec(func)
+    if None in [args, defaults]:
+        return {}
+    else:
+        return dict(zip(reversed(args), reversed(defaults)))
+
+def _varnames(target):
+    """
+    Returns the names of the parameters a class constructor or a factory
+    callable expects to have injected.
+    """
+    if inspect.isclass(target):
+        return [x for x in inspect.getargspec(target.__init__)][0][1:]
+    return [x for x in inspect.getargspec(target)][0]
+
+def _defaults(target):
+    if inspect.isclass(target):
+        return _default_args(target.__init__)
+    return _default_args(target)
+
+
+class _Component(object):
+    """
+    Registry record for a component class or factory.
+    """
+    __slots__ = ('name', 'varnames', 'process', 'retry', 'cache')
+
+    def __init__(self, name, varnames, process=False, retry=None, cache=None):
+        self.name = name
+        self.varnames = varnames
+        self.process = process
+        self.retry = retry
+        self.cache = cache
+
+
+class _Product(object):
+    """
+    Stands for the product of a factory in the backing dependency digraph.
+    The digraph keys vertices by value, while a product need not be
+    hashable, and two factories may well hand out equal ones.  The stage,
+    and any lifecycle methods, are those of the product itself.
+    """
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.value, name)
+
+    @property
+    def stage(self):
+        return self.value.stage
+
+    @stage.setter
+    def stage(self, stage):
+        self.value.stage = stage
+
+    def __repr__(self):
+        return '<%s product %r>' % (self.name, self.value)
+
+
+class _Scope(dict):
+    """
+    A dictionary that falls back to a parent mapping for reads.  Writes and
+    deletes only ever touch the local entries, so the parent is shared
+    copy-on-write, and creating a scope costs nothing up front.
+    """
+    def __init__(self, parent):
+        super(_Scope, self).__init__()
+        self.parent = parent
+
+    def __missing__(self, key):
+        return self.parent[key]
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.parent
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def keys(self):
+        return list(set(dict.keys(self)) | set(self.parent.keys()))
+
+
 class Pycocontainer(LifecycleContainer):
 
-    def __init__(self, name):
-        super(Pycocontainer, self).__init__()
+    def __init__(self, name, indexed=False, lazy=False, idle_timeout=None, parent=None,
+                 counters=False):
+        """
+        If lazy is True, get and instance_of hand out started instances,
+        starting each component and its precursors the first time it is
+        asked for.  If idle_timeout is also set, lazily started components
+        that have not been handed out for that many seconds are stopped
+        again by reap_idle, which get and instance_of also call once every
+        idle_timeout seconds.
+
+        If parent is given, this is a child container: see child.
+        If counters is True, the container starts out counting: see count.
+        """
+        super(Pycocontainer, self).__init__(indexed, counters)
         self.name = name
-        self._component_registry = {}
-        self._component_names = {}
-        self._instance_registry = {}
+        self.lazy = lazy
+        self.idle_timeout = idle_timeout
+        self._lazy_lock = threading.RLock()
+        # id(vertex) -> when it was last handed out, in lazy mode
+        self._last_used = {}
+        self._last_reap = _clock()
+        self._parent = parent
+        self._children = weakref.WeakSet()
+        # id(vertex) -> vertices of ancestor containers it depends on
+        self._upstream = {}
+        # id(ancestor vertex) -> vertices of this container depending on it
+        self._downstream = {}
+        # name -> (factory, hint key, hints, build time) of memoized products
+        self._memo = {}
+        # name -> future of an instance being built by ainstance_of
+        self._pending = {}
+        # name -> names its pending build is waiting on, across callers
+        self._waits = {}
+        # factory -> hint key -> name, least recently used first
+        self._products = {}
+        if parent is None:
+            self._component_registry = {}
+            self._component_names = {}
+            self._instance_registry = {}
+            # name -> (factory, deps, sources) used to build each component
+            # instance, where sources maps the parameters that took component
+            # instances to the names of those instances
+            self._instance_recipes = {}
+            # name -> vertex in the graph, which is the instance itself unless
+            # it is the product of a factory
+            self._instance_nodes = {}
+            # id(vertex) -> name, for every vertex in the graph
+            self._instance_names = {}
+            # alias -> name of the memoized product it was handed out as
+            self._aliases = {}
+        else:
+            self._component_registry = _Scope(parent._component_registry)
+            self._component_names = _Scope(parent._component_names)
+            self._instance_registry = _Scope(parent._instance_registry)
+            self._instance_recipes = _Scope(parent._instance_recipes)
+            self._instance_nodes = _Scope(parent._instance_nodes)
+            self._instance_names = _Scope(parent._instance_names)
+            self._aliases = _Scope(parent._aliases)
+            parent._children.add(self)
+
+
+    def child(self, name=None):
+        """
+        Returns a child container.  It sees the components, constants and
+        instances of this container, but registers and instantiates into
+        registries and a dependency digraph of its own, so this container
+        is never affected.  Starting a child instance first starts the
+        instances of this container it depends on, and stopping or failing
+        those first stops or fails the child instances depending on them.
+        Replacing one of those replaces the child instances depending on
+        it too, and removing one stops them and drops their links to it.
+        """
+        return Pycocontainer(name or self.name, self._instance_graph.indexed,
+                             self.lazy, self.idle_timeout, self, self._counters is not None)
+
+
+    def dispose(self):
+        """
+        Stops every instance of a child container, and detaches it from
+        its parent's lifecycle.
+        """
+        self.stop()
+        if self._parent is not None:
+            self._parent._children.discard(self)
+
 
+    def _owns(self, instance):
+        return instance in self._instance_graph.edges
 
-    def register(self, cls, name):
+
+    def _owner(self, instance):
+        """
+        Returns the container, this one or an ancestor, whose dependency
+        digraph holds instance.
+        """
+        container = self
+        while not container._owns(instance):
+            container = container._parent
+        return container
+
+
+    def _vertex(self, instance):
+        """
+        Returns the vertex standing for instance in the dependency digraph
+        of this container or an ancestor, which is instance itself unless
+        it is the product of a factory.
+        """
+        if instance is None or id(instance) in self._instance_names:
+            return instance
+        nodes = self._instance_nodes
+        for key in nodes.keys():
+            if isinstance(nodes[key], _Product) and nodes[key].value is instance:
+                return nodes[key]
+        return instance
+
+
+    def start(self, instance=None):
+        instance = self._vertex(instance)
+        if self._parent is not None:
+            dag = self._instance_graph
+            nodes = dag.toporder if instance is None else dag.precursors(instance) + [instance]
+            for node in nodes:
+                self._start_upstream(node)
+        super(Pycocontainer, self).start(instance)
+
+
+    def _start_upstream(self, node):
+        # One thread at a time, for start_background.
+        for dep in self._upstream.get(id(node), []):
+            owner = self._owner(dep)
+            with owner._lazy_lock:
+                owner.start(dep)
+
+
+    def stop(self, instance=None):
+        instance = self._vertex(instance)
+        self._release(instance, 'stop')
+        super(Pycocontainer, self).stop(instance)
+
+
+    def fail(self, instance=None):
+        instance = self._vertex(instance)
+        self._release(instance, 'fail')
+        super(Pycocontainer, self).fail(instance)
+
+
+    def restart(self, instance=None):
+        super(Pycocontainer, self).restart(self._vertex(instance))
+
+
+    def _release(self, instance, op):
+        """
+        Applies op to the descendant container instances that depend on
+        instance, or on anything depending on it, ahead of instance itself.
+        If instance is None, applies op to every child container.
+        """
+        if len(self._children) == 0:
+            return
+        if instance is None:
+            for child in list(self._children):
+                getattr(child, op)()
+        else:
+            self._release_nodes([instance] + self._instance_graph.successors(instance), op)
+
+
+    def _release_nodes(self, nodes, op):
+        for child in list(self._children):
+            for node in nodes:
+                for dependent in list(child._downstream.get(id(node), [])):
+                    getattr(child, op)(dependent)
+            child._release_nodes(nodes, op)
+
+
+    def _linked(self, nodes):
+        """
+        Returns (container, name) pairs for the instances of descendant
+        containers that depend directly on any of nodes, once each.
+        """
+        ret = []
+        for child in list(self._children):
+            for node in nodes:
+                for dependent in child._downstream.get(id(node), []):
+                    pair = (child, child._instance_names[id(dependent)])
+                    if pair not in ret:
+                        ret.append(pair)
+            ret.extend(x for x in child._linked(nodes) if x not in ret)
+        return ret
+
+
+    def _unlink(self, nodes):
+        """
+        Drops whatever links descendant container instances still have to
+        nodes, which are leaving the dependency digraph.
+        """
+        for child in list(self._children):
+            for node in nodes:
+                for dependent in child._downstream.pop(id(node), []):
+                    child._upstream[id(dependent)].remove(node)
+            child._unlink(nodes)
+
+
+    def register(self, cls, name, process=False, retry=None):
         """
         Register a component definition.
         If a component exists with the same name or class, raise an exception.
+        If process is True, instances run in a worker process behind a
+        ProcessProxy, which is what gets injected into dependents.
+        A RetryPolicy given as retry governs how instances are started.
         """
         r = self._component_registry
         ri = self._component_names
-        if cls not in r.keys():
-            if name not in ri.keys():
-                component = {}
-                varnames = [x for x in inspect.getargspec(cls.__init__)][0][1:]
-                component['name'] = name
-                component['varnames'] = varnames
-                r[cls] = component
+        if cls not in r:
+            if name not in ri:
+                r[cls] = _Component(name, _varnames(cls), process, retry)
                 ri[name] = cls
-
-                # If the class has a function named 'start', bind it to 'start' attribute.
-                member = cls.__dict__
-                funcs = [member[arg] for arg in member.keys() if (
-                    member[arg].__class__.__name__ == 'function')]
-                target = [f for f in funcs if f.__name__ == 'start']
-                if len(target) > 0:
-                    cls.start = target[0]
-                target = [f for f in funcs if f.__name__ == 'stop']
-                if len(target) > 0:
-                    cls.stop = target[0]
-                target = [f for f in funcs if f.__name__ == 'fail']
-                if len(target) > 0:
-                    cls.fail = target[0]
+                _bind_lifecycle(cls)
 
             else:
                 raise DuplicateComponentName('%s' % name)
@@ -243,6 +1102,24 @@ class Pycocontainer(LifecycleContainer):
             raise DuplicateComponentClass('%s' % cls)
 
 
+    def register_factory(self, factory, name, cache=None, retry=None):
+        """
+        Register a callable that builds a component.  Its parameters are
+        resolved like constructor arguments, and what it returns is wired
+        into the backing dependency digraph like any component instance.
+        Products are memoized according to cache, a Cache, and are kept for
+        the life of the container if cache is None.
+        """
+        r = self._component_registry
+        ri = self._component_names
+        if factory in r:
+            raise DuplicateComponentClass('%s' % factory)
+        if name in ri:
+            raise DuplicateComponentName('%s' % name)
+        r[factory] = _Component(name, _varnames(factory), False, retry, cache or Cache())
+        ri[name] = factory
+
+
     def add(self, key=None, value=None):
         """
         In addition to lifecycle managed component instances, we can add
@@ -255,135 +1132,544 @@ class Pycocontainer(LifecycleContainer):
             return None
         instances = self._instance_registry
         names = self._component_names
-        if key in instances.keys() or key in names.keys():
+        if key in instances or key in names:
             raise DuplicateInstanceName('Key %s is in use.' % key)
         else:
             instances[key] = value
 
 
-    def get(self, key):
+    def ready(self, key):
+        """
+        Returns the Readiness of the component instance corresponding with
+        the given key, as started by start_background, or None if it isn't
+        being started in the background.
+        """
+        node = self._instance_nodes.get(key)
+        if node is None:
+            return None
+        return self._owner(node)._readiness.get(node)
+
+
+    def get(self, key, timeout=None):
         """
         Returns the component instance corresponding with the given key,
-        or None if it does not exist.
+        or None if it does not exist.  If timeout is given and the instance
+        is being started in the background, waits up to timeout seconds
+        for it to be ready, raising LifecycleException if it isn't.
         """
         instances = self._instance_registry
-        if key in instances.keys():
+        key = self._aliases.get(key, key)
+        if key in instances:
+            readiness = self.ready(key) if timeout is not None else None
+            if readiness is not None and not readiness.wait(timeout):
+                raise LifecycleException('Component %s is not ready' % key)
+            if key in self._memo:
+                self._refresh(key)
+            if self.lazy and key in self._instance_recipes:
+                node = self._instance_nodes[key]
+                self._owner(node)._bring_up(node)
             return instances[key]
         else:
             return None
 
 
+    def _cached(self, factory, hints):
+        """
+        Returns the name of the memoized product of factory for hints,
+        or None.
+        """
+        component = self._component_registry.get(factory)
+        if component is None or component.cache is None:
+            return None
+        return self._products.get(factory, {}).get(_hint_key(hints, component.varnames))
+
+
+    def _memoize(self, factory, name, hints):
+        """
+        Records the product just built under name, dropping the least
+        recently used products of factory if there are too many.
+        """
+        component = self._component_registry[factory]
+        cache = component.cache
+        if cache is None:
+            return
+        key = _hint_key(hints, component.varnames)
+        products = self._products.setdefault(factory, OrderedDict())
+        products[key] = name
+        self._memo[name] = (factory, key, dict(key), _clock())
+        if cache.size is None:
+            return
+        dag = self._instance_graph
+        for old in list(products.values()):
+            if len(products) <= cache.size:
+                break
+            product = self._instance_nodes[old]
+            if old == name or len(dag.edges[product]) > 0:
+                continue
+            self._stop_node(product)
+            self.remove(old)
+
+
+    def _refresh(self, name):
+        """
+        Returns the instance registered under name, rebuilding it first if
+        it is a memoized product older than its cache allows.
+        """
+        factory, key, hints, built = self._memo[name]
+        products = self._products[factory]
+        products[key] = products.pop(key)
+        cache = self._component_registry[factory].cache
+        if cache.ttl is not None and _clock() - built >= cache.ttl:
+            self.replace(name, hints=hints)
+            self._memo[name] = (factory, key, hints, _clock())
+        return self._instance_registry[name]
+
+
+    def _bring_up(self, instance):
+        """
+        Starts instance and its precursors unless it already is started,
+        at most once even when called from several threads.
+        """
+        now = _clock()
+        if getattr(instance, 'stage', Stage.started) is not Stage.started:
+            with self._lazy_lock:
+                if instance.stage is not Stage.started:
+                    self.start(instance)
+                    for node in self._instance_graph.precursors(instance):
+                        self._last_used[id(node)] = now
+        self._last_used[id(instance)] = now
+        if self.idle_timeout is not None and now - self._last_reap >= self.idle_timeout:
+            self.reap_idle()
+        return instance
+
+
+    def reap_idle(self):
+        """
+        Stops lazily started components that have not been handed out for
+        idle_timeout seconds, and that no started component depends on.
+        Returns the stopped instances, in the order they were stopped.
+        """
+        if self.idle_timeout is None:
+            return []
+        ret = []
+        with self._lazy_lock:
+            now = _clock()
+            self._last_reap = now
+            dag = self._instance_graph
+            last_used = self._last_used
+            for node in list(reversed(dag.toporder)):
+                if id(node) not in last_used.keys() or now - last_used[id(node)] < self.idle_timeout:
+                    continue
+                if getattr(node, 'stage', None) is not Stage.started:
+                    continue
+                if [x for x in dag.edges[node] if getattr(x, 'stage', None) is Stage.started]:
+                    continue
+                self._stop_node(node)
+                del(last_used[id(node)])
+                ret.append(node)
+        return ret
+
+
     def remove(self, key):
         """
         Removes an instance from the instance registry and returns it,
-        if it exists.  Otherwise, returns None.
+        if it exists.  Otherwise, returns None.  A child container can only
+        remove its own instances.
         """
         instances = self._instance_registry
-        if key in instances.keys():
+        aliases = self._aliases
+        if dict.__contains__(aliases, key):
+            del(aliases[key])
+            del(self._instance_nodes[key])
+            return instances.pop(key)
+        if dict.__contains__(instances, key):
+            if key in self._instance_recipes:
+                # Child instances depending on it are stopped, and let go of it.
+                node = self._instance_nodes[key]
+                self._release_nodes([node], 'stop')
+                self._unlink([node])
+                self._uninstall(key)
+            if key in self._memo:
+                factory, hint_key = self._memo.pop(key)[:2]
+                del(self._products[factory][hint_key])
+            for alias in [x for x in dict.keys(aliases) if aliases[x] == key]:
+                self.remove(alias)
             return instances.pop(key)
         else:
             return None
 
 
-    def instance_of(self, cls=None, name=None, hints={}):
+    def _name_of(self, node):
+        name = self._instance_names.get(id(node))
+        if name is None:
+            return super(Pycocontainer, self)._name_of(node)
+        return name
+
+    def _aliases_of(self, node):
+        name = self._instance_names.get(id(node))
+        recipe = name is not None and self._instance_recipes.get(name)
+        component = recipe and self._component_registry.get(recipe[0])
+        return () if not component or component.name == name else (component.name,)
+
+
+    def stats(self):
+        ret = super(Pycocontainer, self).stats()
+        classes = Counter()
+        for node in self._instance_graph.toporder:
+            if isinstance(node, _Product):
+                node = node.value
+            cls = node.target if isinstance(node, ProcessProxy) else node.__class__
+            classes[cls.__name__] += 1
+        ret['instances'] = dict(classes)
+        ret['constants'] = len([x for x in dict.keys(self._instance_registry)
+                                if not dict.__contains__(self._instance_recipes, x)])
+        return ret
+
+
+    def _retry_policy(self, node):
+        name = self._instance_names.get(id(node))
+        if name is None:
+            return None
+        component = self._component_registry.get(self._instance_recipes[name][0])
+        if component is None:
+            return None
+        return component.retry
+
+
+    def _plan(self, cls, varnames, defaults, hints):
         """
-        Returns an instance of the given component class.  If one exists
-        with the given name, returns that existing instance.  If none exists,
-        makes every effort to instantiate the component, and any required
-        dependencies.
+        Sorts the named parameters of a constructor or factory into the
+        arguments the registries can satisfy right away, and the registered
+        components that still have to be instantiated for the rest.
+        Returns a dictionary of keyword arguments, and a list of
+        (parameter name, component) pairs.
         """
-
-        if cls is None or name is None:
-            raise Exception('Cannot instantiate without a class and name.')
         components = self._component_registry
         instances = self._instance_registry
         names = self._component_names
-
-        def retrieve(cls, name):
-            """
-            Attempt to retrieve an instance with this name and class.
-            If there is a mismatch, raise an exception.
-            """
-            if name in instances.keys():
-                ret = instances[name]
-                if ret.__class__ is cls:
-                    return ret
+        deps = {}
+        wanted = []
+        ignored = []
+        for vname in varnames:
+            if vname in components:
+                deps[vname] = components[vname]
+            # is there a hint matching this vname?
+            elif vname in hints.keys():
+                # is there an instance in the instance reg with this vname hint?
+                if hints[vname] in instances:
+                    instance = instances[hints[vname]]
+                    deps[vname] = instance
+                # if not, they're explicitly asking for something we don't have.
                 else:
-                    raise DuplicateInstanceName('Name belongs to component of another class')
+                    raise UnsatisfiableDependency('No component instance named %s in container.' % vname)
+            # if not, is there an instance registered with this name?
+            elif vname in instances:
+                instance = instances[vname]
+                deps[vname] = instance
+            # if not, is there a component registered with this vname?
+            elif vname in names:
+                wanted.append((vname, names[vname]))
+            # if not, does this dependency have a default value?
+            elif vname in defaults.keys():
+                # We'll use the default. Ignore it and proceed.
+                ignored.append(vname)
+                continue
+            # if not, the dependency is unsatisfiable
             else:
-                return instantiate(cls, name)
+                raise UnsatisfiableDependency(
+                    'Cannot instantiate %s without component named %s.' % (cls, vname))
+
+        args = [x for x in varnames if x not in ignored]
+        if len(args) != len(deps.keys()) + len(wanted):
+            raise Exception('Unsatisfied dependency for args:%s, deps:%s' % (args, deps))
+        return deps, wanted
 
-        def default_args(func):
-            args, varargs, keywords, defaults = inspect.getargspec(func)
-            if None in [args, defaults]:
-                return []
+
+    def _resolve(self, cls, varnames, defaults, hints, processing):
+        """
+        Resolves the named parameters of a constructor or factory against
+        the registries, instantiating registered components as needed.
+        Returns a dictionary of keyword arguments.
+        """
+        instances = self._instance_registry
+        deps, wanted = self._plan(cls, varnames, defaults, hints)
+        for vname, cl in wanted:
+            # An earlier dependency may have brought this one in already.
+            if vname in instances:
+                deps[vname] = instances[vname]
+            # if not, and if this isn't a cyclic dependency, recurse.
+            elif vname not in processing:
+                processing.append(vname)
+                deps[vname] = self._instantiate(cl, vname, hints, processing)
+                processing.remove(vname)
             else:
-                return dict(zip(reversed(args), reversed(defaults)))
-
-        def instantiate(cls=None, name='', processing=[]):
-            """
-            Instantiate a new component instance.
-            """
-            if cls not in components.keys():
-                self.register(cls, name)
-
-            component = components[cls]
-            varnames = component['varnames']
-            defaults = default_args(cls.__init__)
-            deps = {}
-            ignored = []
-            for vname in varnames:
-                if vname in components.keys():
-                    deps[vname] = components[vname]
-                # is there a hint matching this vname?
-                elif vname in hints.keys():
-                    # is there an instance in the instance reg with this vname hint?
-                    if hints[vname] in instances.keys():
-                        instance = instances[hints[vname]]
-                        deps[vname] = instance
-                    # if not, they're explicitly asking for something we don't have.
-                    else:
-                        raise UnsatisfiableDependency('No component instance named %s in container.' % vname)
-                # if not, is there an instance registered with this name?
-                elif vname in instances.keys():
-                    instance = instances[vname]
-                    deps[vname] = instance
-                # if not, is there a component registered with this vname?
-                elif vname in names.keys():
-                    # if so, and if this isn't a cyclic dependency, recurse.
-                    cl = names[vname]
-                    if vname not in processing:
-                        processing.append(vname)
-                        instance = instantiate(cl, vname, processing)
-                        deps[vname] = instance
-                        processing.remove(vname)
-                    else:
-                        raise CircularDependency()
-                # if not, does this dependency have a default value?
-                elif vname in defaults.keys():
-                    # We'll use the default. Ignore it and proceed.
-                    ignored.append(vname)
-                    continue
-                # if not, the dependency is unsatisfiable
-                else:
-                    raise UnsatisfiableDependency(
-                        'Cannot instantiate %s without component named %s.' % (cls, vname))
+                raise CircularDependency()
+        return deps
 
-            args = [x for x in varnames if x not in ignored]
 
-            dag = self._instance_graph
-            if len(args) == len(deps.keys()):
-                instance = cls(**deps)
-                instances[name] = instance
-                # update the backing dependency digraph
-                dag.add(instance)
-                for dep in [deps[x] for x in deps.keys()]:
-                    # Won't trigger for constants, only registered components.
-                    if dep.__class__ in self._component_registry.keys():
-                        dag.add(dep, instance)
-                return instance
+    def _instantiate(self, cls, name, hints, processing):
+        """
+        Instantiate a new component instance.
+        """
+        components = self._component_registry
+        if cls not in components:
+            self.register(cls, name)
+
+        self._tally('instantiate', len(processing) + 1)
+        tracer = self._tracer
+        begin = tracer and _clock()
+        component = components[cls]
+        deps = self._resolve(cls, component.varnames, _defaults(cls), hints, processing)
+        instance = self._construct(cls, deps)
+        self._install(name, cls, instance, deps, hints)
+        self._memoize(cls, name, hints)
+        if tracer is not None:
+            tracer.record('instantiate', name, begin, _clock())
+        return instance
+
+
+    def _construct(self, factory, deps, asynchronous=False):
+        """
+        Builds an instance.  Unless asynchronous, raises AsynchronousComponent
+        rather than hand out a component that only ainstance_of can finish:
+        a class with an ainit coroutine method, or a coroutine factory.
+        """
+        component = self._component_registry.get(factory)
+        if component is not None and component.process:
+            return ProcessProxy(factory, deps)
+        if not asynchronous and inspect.isclass(factory) and hasattr(factory, 'ainit'):
+            raise AsynchronousComponent('%s has an ainit method: use ainstance_of.' % factory)
+        instance = factory(**deps)
+        if not asynchronous and getattr(inspect, 'isawaitable', lambda x: False)(instance):
+            if hasattr(instance, 'close'):
+                instance.close()
+            raise AsynchronousComponent('%s returned an awaitable: use ainstance_of.' % factory)
+        return instance
+
+
+    def _install(self, name, factory, instance, deps, hints={}):
+        """
+        Registers a freshly built instance under name, and wires it into
+        the backing dependency digraph, after the instances its arguments
+        were resolved to, by hint or by name.
+        """
+        instances = self._instance_registry
+        nodes = self._instance_nodes
+        aliases = self._aliases
+        node = instance if inspect.isclass(factory) else _Product(name, instance)
+        sources = {}
+        for vname in deps:
+            source = hints.get(vname, vname)
+            # Won't trigger for constants, only component instances.
+            if source in nodes and instances[source] is deps[vname]:
+                sources[vname] = aliases.get(source, source)
+        instances[name] = instance
+        nodes[name] = node
+        self._instance_recipes[name] = (factory, deps, sources)
+        self._instance_names[id(node)] = name
+        for alias in [x for x in aliases.keys() if aliases[x] == name]:
+            instances[alias] = instance
+            nodes[alias] = node
+        # update the backing dependency digraph
+        dag = self._instance_graph
+        dag.add(node)
+        for source in sources.values():
+            dep = nodes[source]
+            if self._owns(dep):
+                dag.add(dep, node)
             else:
-                raise Exception('Unsatisfied dependency for args:%s, deps:%s' % (args, deps))
+                # An instance of an ancestor container.
+                self._upstream.setdefault(id(node), []).append(dep)
+                self._downstream.setdefault(id(dep), []).append(node)
+
+
+    def _uninstall(self, name):
+        """
+        Drops the instance registered under name from the recipes and the
+        backing dependency digraph, leaving the instance registry alone.
+        """
+        node = self._instance_nodes.pop(name)
+        del(self._instance_recipes[name])
+        del(self._instance_names[id(node)])
+        self._last_used.pop(id(node), None)
+        self._readiness.pop(node, None)
+        for dep in self._upstream.pop(id(node), []):
+            self._downstream[id(dep)].remove(node)
+        self._instance_graph.remove(node)
+
 
-        ret = retrieve(cls, name)
+    def instance_of(self, cls=None, name=None, hints={}):
+        """
+        Returns an instance of the given component class, or the product of
+        the given registered factory.  If one exists with the given name,
+        returns that existing instance.  If none exists, makes every effort
+        to instantiate the component, and any required dependencies.
+        """
+
+        if cls is None or name is None:
+            raise Exception('Cannot instantiate without a class and name.')
+        instances = self._instance_registry
+        name = self._aliases.get(name, name)
+
+        # Attempt to retrieve an instance with this name and class.
+        # If there is a mismatch, raise an exception.
+        self._tally('instance_of')
+        if name in instances:
+            ret = instances[name]
+            recipe = self._instance_recipes.get(name)
+            if ret.__class__ is not cls and (recipe is None or recipe[0] is not cls):
+                raise DuplicateInstanceName('Name belongs to component of another class')
+            if name in self._memo:
+                ret = self._refresh(name)
+            self._tally('instance_of_hits')
+        else:
+            # A factory hands out what it built for the same hints before,
+            # and name becomes an alias for it.
+            cached = self._cached(cls, hints)
+            if cached is None:
+                ret = self._instantiate(cls, name, hints, [])
+            else:
+                ret = self._refresh(cached)
+                self._aliases[name] = cached
+                instances[name] = ret
+                self._instance_nodes[name] = self._instance_nodes[cached]
+                name = cached
+                self._tally('instance_of_hits')
+        if self.lazy:
+            node = self._instance_nodes[name]
+            self._owner(node)._bring_up(node)
         return ret
+
+
+    def ainstance_of(self, cls=None, name=None, hints={}):
+        """
+        Coroutine counterpart of instance_of.  Sibling dependencies are built
+        concurrently, factories may be coroutine functions, and instances
+        may define an ainit coroutine method, awaited once after they are
+        constructed.  Each name is still built and registered only once,
+        however many callers ask for it at the same time.
+        Requires Python 3.5 or later.
+        """
+        if cls is None or name is None:
+            raise Exception('Cannot instantiate without a class and name.')
+        try:
+            from pycoasync import ainstance_of
+        except (ImportError, SyntaxError):
+            raise NotImplemented('Asynchronous instantiation requires Python 3.5 or later.')
+        return ainstance_of(self, cls, name, hints)
+
+
+    def replace(self, name, factory=None, hints={}):
+        """
+        Hot-swaps the component instance registered under name with one
+        built by factory, which may be a class or any callable whose
+        parameters are resolved like constructor arguments.  If factory is
+        None, the instance is rebuilt from its own class, which is useful
+        together with hints to change constructor arguments.  Parameters
+        that no hint is given for keep the wiring the old instance had.
+
+        Every replacement is built before anything is stopped, so a
+        constructor that fails leaves the container as it was, without
+        any dependencies built along the way.  Then the
+        old instance and its successors are stopped in descending order,
+        every dependent whose constructor arguments referenced a replaced
+        instance is swapped for its rebuilt counterpart, and whatever was
+        started before is started again in ascending order.  Components
+        outside that subgraph are not touched.
+        A new class is registered with the name, process and retry settings
+        of the component it replaces.  If the instance goes by that
+        component name, the name is rebound to the new class.
+        Returns the new instance.
+        """
+        instances = self._instance_registry
+        components = self._component_registry
+        names = self._component_names
+        recipes = self._instance_recipes
+        dag = self._instance_graph
+        if not dict.__contains__(recipes, name):
+            raise UnsatisfiableDependency('No component instance named %s in container.' % name)
+
+        old = self._instance_nodes[name]
+        old_factory, _, sources = recipes[name]
+        if factory is None:
+            factory = old_factory
+        wiring = dict(sources)
+        wiring.update(hints)
+        registered = rebound = False
+        if inspect.isclass(factory) and factory not in components:
+            component = components.get(old_factory)
+            if component is None:
+                component = _Component(None, None)
+            components[factory] = _Component(component.name, _varnames(factory),
+                                             component.process, component.retry)
+            _bind_lifecycle(factory)
+            registered = True
+            # If this instance goes by the component name, rebind it to the
+            # new class, so later resolutions by name get the replacement
+            # too.  The old class stays registered for its other instances.
+            if component.name == name and names.get(name) is old_factory:
+                rebound = dict.__contains__(names, name)
+                names[name] = factory
+
+        # Build the replacement, and a rebuilt instance of every dependent,
+        # in ascending order, substituting replaced instances into the
+        # constructor arguments recorded for each node.
+        affected = [old] + dag.successors(old)
+        keys = [self._instance_names[id(node)] for node in affected]
+        existing = set(dag.toporder)
+        try:
+            deps = self._resolve(factory, _varnames(factory), _defaults(factory), wiring, [name])
+            replacement = self._construct(factory, deps)
+            swapped = {name: replacement}
+            rebuilt = [(name, factory, replacement, deps, wiring)]
+            for key in keys[1:]:
+                cls, args, sources = recipes[key]
+                args = dict((k, swapped[sources[k]] if sources.get(k) in swapped else v)
+                            for k, v in args.items())
+                swapped[key] = self._construct(cls, args)
+                # The recorded sources double as hints for the rebuilt instance.
+                rebuilt.append((key, cls, swapped[key], args, sources))
+        except Exception:
+            # Drop the dependencies resolving the replacement brought in.
+            for node in reversed(dag.toporder):
+                if node not in existing:
+                    self.remove(self._instance_names[id(node)])
+            if registered:
+                del(components[factory])
+                if names.get(name) is factory:
+                    if rebound:
+                        names[name] = old_factory
+                    else:
+                        del(names[name])
+            raise
+
+        started = [key for key, node in zip(keys, affected)
+                   if getattr(node, 'stage', None) is Stage.started]
+        # Child container instances depending on the subgraph go first, and
+        # are replaced in turn once it is swapped.
+        linked = self._linked(affected)
+        restart = []
+        for child, key in linked:
+            node = child._instance_nodes[key]
+            for x in [node] + child._instance_graph.successors(node):
+                pair = (child, child._instance_names[id(x)])
+                if getattr(x, 'stage', None) is Stage.started and pair not in restart:
+                    restart.append(pair)
+        self._release_nodes(affected, 'stop')
+        for key, node in reversed(list(zip(keys, affected))):
+            if key in started:
+                self._stop_node(node)
+        for key, cls, instance, args, sources in rebuilt:
+            self._uninstall(key)
+            self._install(key, cls, instance, args, sources)
+        for key in keys:
+            if key in started:
+                self._start_node(self._instance_nodes[key])
+        try:
+            for child, key in linked:
+                child.replace(key)
+            for child, key in restart:
+                child.start(child._instance_nodes[key])
+        finally:
+            self._unlink(affected)
+        return replacement
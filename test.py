@@ -9,6 +9,16 @@ Published under the terms of the Apache Software License v2.0
 """
 
 from pycocontainer import *
+from pycocontainer import _serve
+import json
+import multiprocessing
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import time
 import unittest
 
 class A(Lifecycle):
@@ -52,6 +62,127 @@ class B(Lifecycle):
         self.counter['failed'] -= 1
         # print "Called boogie()"
 
+class Scorer(Lifecycle):
+    def __init__(self, factor):
+        super(Scorer, self).__init__()
+        self.factor = factor
+
+    @startmethod
+    def warm(self, *args): pass
+
+    @stopmethod
+    def cool(self, *args): pass
+
+    @failmethod
+    def burn(self, *args): pass
+
+    def pid(self):
+        return os.getpid()
+
+    def score(self, x):
+        return x * self.factor
+
+    def echo(self, data):
+        return data
+
+class Flaky(Lifecycle):
+    def __init__(self, failures):
+        super(Flaky, self).__init__()
+        self.failures = failures
+        self.attempts = 0
+
+    @startmethod
+    def connect(self, *args):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise IOError('Not ready yet')
+
+    @stopmethod
+    def disconnect(self, *args): pass
+
+    @failmethod
+    def crash(self, *args): pass
+
+class Needy(Lifecycle):
+    def __init__(self, flaky):
+        super(Needy, self).__init__()
+        self.flaky = flaky
+
+    @startmethod
+    def go(self, *args): pass
+
+    @stopmethod
+    def halt(self, *args): pass
+
+    @failmethod
+    def die(self, *args): pass
+
+class Pool(object):
+    def __init__(self, size):
+        self.size = size
+
+class Client(Lifecycle):
+    def __init__(self, pool):
+        super(Client, self).__init__()
+        self.pool = pool
+
+    @startmethod
+    def connect(self, *args): pass
+
+    @stopmethod
+    def disconnect(self, *args): pass
+
+    @failmethod
+    def crash(self, *args): pass
+
+class Slow(Lifecycle):
+    def __init__(self, gate):
+        super(Slow, self).__init__()
+        self.gate = gate
+
+    @startmethod
+    def warm(self, *args):
+        self.gate.wait(5)
+
+    @stopmethod
+    def cool(self, *args): pass
+
+    @failmethod
+    def burn(self, *args): pass
+
+class Waiter(Lifecycle):
+    def __init__(self, slow):
+        super(Waiter, self).__init__()
+        self.slow = slow
+
+    @startmethod
+    def go(self, *args): pass
+
+    @stopmethod
+    def halt(self, *args): pass
+
+    @failmethod
+    def die(self, *args): pass
+
+class Slim(SlottedLifecycle):
+    __slots__ = ('b', 'counter')
+
+    def __init__(self, b):
+        super(Slim, self).__init__()
+        self.b = b
+        self.counter = 0
+
+    @startmethod
+    def up(self, *args):
+        self.counter += 1
+
+    @stopmethod
+    def down(self, *args):
+        self.counter -= 1
+
+    @failmethod
+    def out(self, *args): pass
+
 class C(object):
     def __init__(self, d):
         self.d = d
@@ -390,6 +521,688 @@ class TestPycocontainer(unittest.TestCase):
         c = pyco.instance_of(A, 'c_instance', {'name':'brother'})
         self.assertEquals(c.name, 'checkitoutnow')
 
+    def test_replace_component(self):
+        # Replacing a component rebuilds and restarts its dependents,
+        # but leaves unrelated components alone.
+        pyco = self.pyco
+        pyco.register(A, 'a')
+        pyco.register(B, 'b')
+        a = pyco.instance_of(A, 'a')
+        other = pyco.instance_of(B, 'other')
+        pyco.start()
+        old_b = a.b
+
+        class B2(B): pass
+        b = pyco.replace('b', B2)
+        self.assertIsInstance(b, B2)
+        self.assertIs(pyco.get('b'), b)
+        self.assertEqual(old_b.stage, Stage.stopped)
+        self.assertEqual(b.stage, Stage.started)
+
+        # The dependent was rebuilt against the replacement, and restarted.
+        a2 = pyco.get('a')
+        self.assertIsNot(a2, a)
+        self.assertIs(a2.b, b)
+        self.assertEqual(a.stage, Stage.stopped)
+        self.assertEqual(a2.stage, Stage.started)
+        self.assertEqual([b, a2], pyco._instance_graph.precursors(a2) + [a2])
+        self.assertNotIn(a, pyco._instance_graph.toporder)
+
+        # Untouched.
+        self.assertEqual(other.stage, Stage.started)
+        self.assertEqual(-1, other.counter['started'])
+        self.assertEqual(0, other.counter['stopped'])
+
+        # Later resolutions by name get the new class.
+        self.assertIs(pyco.instance_of(A, 'c').b, b)
+
+    def test_replace_keeps_settings(self):
+        # A new class takes over the settings of the one it replaces, and
+        # the old class stays registered for its other instances.
+        pyco = self.pyco
+        policy = RetryPolicy(attempts=3, backoff=0.01, jitter=0)
+        pyco.add('failures', 0)
+        pyco.register(Flaky, 'flaky', retry=policy)
+        pyco.instance_of(Flaky, 'flaky')
+        class Flaky2(Flaky): pass
+        pyco.replace('flaky', Flaky2)
+        self.assertIs(policy, pyco._component_registry[Flaky2].retry)
+        self.assertIs(Flaky2, pyco._component_names['flaky'])
+        self.assertIn(Flaky, pyco._component_registry)
+        self.assertIsInstance(pyco.instance_of(Flaky, 'other'), Flaky)
+
+    def test_replace_rolls_back(self):
+        # When a dependent cannot be rebuilt, nothing is stopped or rewired.
+        class Picky(A):
+            def __init__(self, b):
+                if type(b) is not B:
+                    raise ValueError('Wants a B')
+                super(Picky, self).__init__(b)
+        pyco = self.pyco
+        pyco.register(A, 'a')
+        pyco.register(B, 'b')
+        pyco.register(Picky, 'picky')
+        picky = pyco.instance_of(Picky, 'picky')
+        b = picky.b
+        pyco.start()
+        class B2(B): pass
+        self.assertRaises(ValueError, pyco.replace, 'b', B2)
+        self.assertIs(b, pyco.get('b'))
+        self.assertIs(picky, pyco.get('picky'))
+        self.assertEqual([b], pyco._instance_graph.precursors(picky))
+        self.assertEqual(Stage.started, b.stage)
+        self.assertEqual(Stage.started, picky.stage)
+        self.assertIs(B, pyco._component_names['b'])
+        self.assertNotIn(B2, pyco._component_registry)
+
+    def test_replace_with_hints(self):
+        # Rebuild a component from its own class with different arguments.
+        pyco = self.pyco
+        pyco.register(A, 'a')
+        pyco.register(B, 'b')
+        funk = pyco.instance_of(B, 'funk')
+        soul = pyco.instance_of(B, 'soul')
+        foo = pyco.instance_of(A, 'foo', {'b':'funk'})
+        foo2 = pyco.replace('foo', hints={'b':'soul'})
+        self.assertIs(foo2.b, soul)
+        self.assertIs(pyco.get('foo'), foo2)
+        self.assertEqual([soul], pyco._instance_graph.precursors(foo2))
+        self.assertRaises(UnsatisfiableDependency, pyco.replace, 'nope', B)
+
+    def test_replace_keeps_wiring(self):
+        # The replacement is wired like the old instance, unless hinted
+        # otherwise, and a failed replace leaves nothing behind.
+        class A2(A): pass
+        class Boom(object):
+            def __init__(self, b):
+                raise ValueError('Boom')
+        pyco = self.pyco
+        pyco.register(A, 'a')
+        pyco.register(B, 'b')
+        funk = pyco.instance_of(B, 'funk')
+        pyco.instance_of(A, 'foo', {'b':'funk'})
+        foo2 = pyco.replace('foo', A2)
+        self.assertIs(funk, foo2.b)
+        self.assertIsNone(pyco.get('b'))
+        self.assertRaises(ValueError, pyco.replace, 'funk', Boom)
+        self.assertIsNone(pyco.get('b'))
+        self.assertIs(funk, pyco.get('funk'))
+        self.assertEqual([funk, foo2], pyco._instance_graph.toporder)
+        self.assertNotIn(Boom, pyco._component_registry)
+
+        # Only an instance that goes by its component name rebinds it.
+        class B2(B): pass
+        pyco.replace('funk', B2)
+        self.assertNotIn('funk', pyco._component_names)
+        self.assertIs(B, pyco._component_names['b'])
+        self.assertEqual('b', pyco._component_registry[B2].name)
+        pyco.instance_of(B, 'a')
+        class B3(B): pass
+        pyco.replace('a', B3)
+        self.assertIs(A, pyco._component_names['a'])
+        self.assertEqual('a', pyco._component_registry[A].name)
+
+    def test_indexed_graph(self):
+        # An indexed container answers the same dependency questions.
+        pyco = Pycocontainer('Indexed container', indexed=True)
+        pyco.register(A, 'a')
+        pyco.register(B, 'b')
+        a = pyco.instance_of(A, 'a')
+        dag = pyco._instance_graph
+        self.assertTrue(dag.reaches(a.b, a))
+        self.assertFalse(dag.reaches(a, a.b))
+        self.assertEqual([a], dag.successors(a.b))
+        pyco.start(a)
+        self.assertEqual(a.b.stage, Stage.started)
+        pyco.stop(a.b)
+        self.assertEqual(a.stage, Stage.stopped)
+        b = pyco.replace('b')
+        self.assertEqual([pyco.get('a')], dag.successors(b))
+
+    def test_process_components(self):
+        # A component registered with process=True runs in a worker
+        # process, behind a proxy that follows the container lifecycle.
+        pyco = self.pyco
+        pyco.add('factor', 3)
+        pyco.register(Scorer, 'scorer', process=True)
+        scorer = pyco.instance_of(Scorer, 'scorer')
+        self.assertIsInstance(scorer, ProcessProxy)
+        self.assertIs(pyco.instance_of(Scorer, 'scorer'), scorer)
+        self.assertRaises(LifecycleException, scorer.score, 1)
+
+        pyco.start()
+        self.assertEqual(scorer.stage, Stage.started)
+        self.assertNotEqual(os.getpid(), scorer.pid())
+        self.assertEqual(6, scorer.score(2))
+        # Large payloads travel through the shared buffer.
+        data = b'x' * (1 << 17)
+        self.assertEqual(data, scorer.echo(data))
+        self.assertRaises(TypeError, scorer.score)
+
+        process = scorer._process
+        pyco.stop()
+        self.assertEqual(scorer.stage, Stage.stopped)
+        self.assertFalse(process.is_alive())
+
+        # Restarting forks a fresh worker.
+        pyco.start(scorer)
+        self.assertEqual(6, scorer.score(2))
+        pyco.fail()
+        self.assertEqual(scorer.stage, Stage.failed)
+
+    def test_process_worker_binding(self):
+        # A worker that was spawned rather than forked imports the component
+        # class afresh, so it binds the lifecycle methods itself.
+        class Fresh(Lifecycle):
+            def __init__(self, factor):
+                super(Fresh, self).__init__()
+                self.factor = factor
+
+            @startmethod
+            def warm(self, *args): pass
+
+            @stopmethod
+            def cool(self, *args): pass
+
+            @failmethod
+            def burn(self, *args): pass
+
+            def score(self, x):
+                return x * self.factor
+
+        self.assertFalse(hasattr(Fresh, 'start'))
+        conn, child = multiprocessing.Pipe()
+        worker = threading.Thread(target=_serve, args=(
+            Fresh, {'factor': 2}, child, multiprocessing.RawArray('c', 16), 8))
+        worker.start()
+        conn.send(('start', (), {}))
+        self.assertEqual(('ok', [Stage.started]), conn.recv())
+        conn.send(('score', (3,), {}))
+        self.assertEqual(('ok', [6]), conn.recv())
+        conn.send(('stop', (), {}))
+        self.assertEqual(('ok', [Stage.stopped]), conn.recv())
+        worker.join()
+
+    def test_retry_start(self):
+        # A component with a retry policy gets more than one chance to start.
+        pyco = self.pyco
+        pyco.add('failures', 2)
+        pyco.register(Flaky, 'flaky', retry=RetryPolicy(attempts=3, backoff=0.01, jitter=0))
+        pyco.register(Needy, 'needy')
+        needy = pyco.instance_of(Needy, 'needy')
+        pyco.start()
+        self.assertEqual(3, needy.flaky.attempts)
+        self.assertEqual(needy.flaky.stage, Stage.started)
+        self.assertEqual(needy.stage, Stage.started)
+        self.assertEqual(pyco.stage, Stage.started)
+
+    def test_retry_exhausted(self):
+        # When retries run out, only the failed branch is held back.
+        pyco = self.pyco
+        pyco.add('failures', 5)
+        pyco.register(Flaky, 'flaky', retry=RetryPolicy(attempts=2, backoff=0.01, jitter=0))
+        pyco.register(Needy, 'needy')
+        pyco.register(B, 'b')
+        needy = pyco.instance_of(Needy, 'needy')
+        b = pyco.instance_of(B, 'b')
+        try:
+            pyco.start()
+            self.fail('Expected a LifecycleException')
+        except LifecycleException as e:
+            # The last reason the start failed comes along.
+            self.assertIsInstance(e.__cause__, IOError)
+            self.assertIn('Not ready yet', str(e))
+        self.assertEqual(2, needy.flaky.attempts)
+        self.assertEqual(needy.flaky.stage, Stage.failed)
+        self.assertEqual(needy.stage, Stage.stopped)
+        self.assertEqual(b.stage, Stage.started)
+        self.assertEqual(pyco.stage, Stage.starting)
+
+        # The deadline cuts retries short.
+        pyco = Pycocontainer('Deadline container')
+        pyco.add('failures', 5)
+        pyco.register(Flaky, 'flaky', retry=RetryPolicy(
+            attempts=10, backoff=0.05, jitter=0, deadline=0.1))
+        flaky = pyco.instance_of(Flaky, 'flaky')
+        self.assertRaises(LifecycleException, pyco.start)
+        self.assertEqual(2, flaky.attempts)
+
+    def test_lazy_start(self):
+        # A lazy container starts components when they are first asked for.
+        pyco = Pycocontainer('Lazy container', lazy=True, idle_timeout=0.05)
+        pyco.register(A, 'a')
+        pyco.register(B, 'b')
+        other = B()
+        pyco.add('other', other)
+        a = pyco.instance_of(A, 'a')
+        self.assertEqual(a.stage, Stage.started)
+        self.assertEqual(a.b.stage, Stage.started)
+        self.assertIs(pyco.get('a'), a)
+        self.assertEqual(1, a.counter['started'])
+        # Constants are left alone.
+        self.assertEqual(pyco.get('other').stage, Stage.stopped)
+
+        # A dependency that was handed out isn't reaped while a is running.
+        b = pyco.get('b')
+        time.sleep(0.03)
+        pyco.get('a')
+        time.sleep(0.03)
+        self.assertEqual([], pyco.reap_idle())
+        self.assertEqual(b.stage, Stage.started)
+        time.sleep(0.06)
+        self.assertEqual([a, b], pyco.reap_idle())
+        self.assertEqual(a.stage, Stage.stopped)
+        self.assertEqual(b.stage, Stage.stopped)
+
+        # And comes back when needed.
+        self.assertEqual(pyco.get('a').stage, Stage.started)
+        self.assertEqual(2, a.counter['started'])
+
+    def test_child_containers(self):
+        # A child sees its parent's components and instances, but keeps
+        # its own instances to itself.
+        pyco = self.pyco
+        pyco.register(A, 'a')
+        pyco.register(B, 'b')
+        b = pyco.instance_of(B, 'b')
+        child = pyco.child('Tenant')
+        a = child.instance_of(A, 'a')
+        self.assertIs(a.b, b)
+        self.assertIs(child.get('b'), b)
+        self.assertIs(child.get('a'), a)
+        self.assertIsNone(pyco.get('a'))
+        self.assertEqual([a], child._instance_graph.toporder)
+        self.assertEqual([b], pyco._instance_graph.toporder)
+
+        # Registrations in the child stay in the child.
+        child.register(Needy, 'needy')
+        self.assertNotIn(Needy, pyco._component_registry)
+        self.assertIsNone(pyco.remove('a'))
+        self.assertIsNone(child.remove('b'))
+
+        # Starting a child instance starts what it needs in the parent.
+        child.start(a)
+        self.assertEqual(b.stage, Stage.started)
+        self.assertEqual(a.stage, Stage.started)
+
+        # Stopping the parent instance stops the child dependents first.
+        pyco.stop(b)
+        self.assertEqual(a.stage, Stage.stopped)
+        child.start()
+        self.assertEqual(b.stage, Stage.started)
+        pyco.stop()
+        self.assertEqual(a.stage, Stage.stopped)
+
+        # Disposed children are no longer affected by the parent.
+        child.start()
+        child.dispose()
+        self.assertEqual(a.stage, Stage.stopped)
+        self.assertEqual(b.stage, Stage.started)
+        self.assertEqual(0, len(pyco._children))
+        grandchild = pyco.child().child()
+        a = grandchild.instance_of(A, 'a')
+        self.assertIs(a.b, b)
+        grandchild.start()
+        pyco.stop(b)
+        self.assertEqual(a.stage, Stage.stopped)
+
+        # Replacing a parent instance rebuilds the child instances depending
+        # on it, and removing it lets go of them.
+        grandchild.start()
+        b2 = pyco.replace('b')
+        a2 = grandchild.get('a')
+        self.assertIsNot(a2, a)
+        self.assertIs(a2.b, b2)
+        self.assertEqual(a.stage, Stage.stopped)
+        self.assertEqual(a2.stage, Stage.started)
+        self.assertEqual([b2], grandchild._upstream[id(a2)])
+        self.assertEqual({id(b2): [a2]}, grandchild._downstream)
+        pyco.remove('b')
+        self.assertEqual(a2.stage, Stage.stopped)
+        self.assertEqual({}, grandchild._downstream)
+        self.assertEqual([], grandchild._upstream[id(a2)])
+
+    def test_factory_registration(self):
+        # Factories are resolved like constructors, and their products
+        # take part in lifecycle ordering.
+        pyco = self.pyco
+        built = []
+        def pool(size):
+            built.append(size)
+            return Pool(size)
+        pyco.add('size', 4)
+        pyco.add('small', 2)
+        pyco.register_factory(pool, 'pool')
+        pyco.register(Client, 'client')
+        self.assertRaises(DuplicateComponentClass, pyco.register_factory, pool, 'other')
+        client = pyco.instance_of(Client, 'client')
+        self.assertEqual(4, client.pool.size)
+        self.assertIs(pyco.get('pool'), client.pool)
+        self.assertIs(pyco.instance_of(pool, 'pool'), client.pool)
+        self.assertEqual([client.pool], [x.value for x in pyco._instance_graph.precursors(client)])
+        pyco.start()
+        self.assertEqual(client.stage, Stage.started)
+
+        # Products are memoized by the hints for their own parameters, and
+        # a second name for the same product becomes an alias.
+        small = pyco.instance_of(pool, 'small_pool', {'size':'small', 'pool':'nope'})
+        self.assertEqual(2, small.size)
+        self.assertIs(small, pyco.instance_of(pool, 'tiny_pool', {'size':'small'}))
+        self.assertIs(small, pyco.get('tiny_pool'))
+        self.assertEqual([4, 2], built)
+        tiny = pyco.instance_of(Client, 'tiny', {'pool':'tiny_pool'})
+        self.assertIs(small, tiny.pool)
+        self.assertEqual(['small_pool'], [pyco._name_of(x) for x in pyco._instance_graph.precursors(tiny)])
+        self.assertIs(small, pyco.remove('tiny_pool'))
+        self.assertIsNone(pyco.get('tiny_pool'))
+        self.assertIs(small, pyco.get('small_pool'))
+
+    def test_factory_products(self):
+        # Products need not be hashable, nor distinct from one another.
+        pyco = self.pyco
+        def config():
+            return {'debug': True}
+        def one():
+            return 'same'
+        def two():
+            return 'same'
+        pyco.register_factory(config, 'config')
+        pyco.register_factory(one, 'one')
+        pyco.register_factory(two, 'two')
+        self.assertEqual({'debug': True}, pyco.instance_of(config, 'config'))
+        self.assertEqual('same', pyco.instance_of(one, 'one'))
+        self.assertEqual('same', pyco.instance_of(two, 'two'))
+        self.assertEqual(3, len(pyco._instance_graph.toporder))
+        pyco.start()
+        # Products are started and stopped like any component instance.
+        pyco.register(B, 'b')
+        def service():
+            return B()
+        pyco.register_factory(service, 'service')
+        svc = pyco.instance_of(service, 'service')
+        pyco.start(svc)
+        self.assertEqual(svc.stage, Stage.started)
+        pyco.restart(svc)
+        self.assertEqual(svc.stage, Stage.started)
+        pyco.stop(svc)
+        self.assertEqual(svc.stage, Stage.stopped)
+        pyco.fail(svc)
+        self.assertEqual(svc.stage, Stage.failed)
+        self.assertEqual('same', pyco.remove('one'))
+        self.assertEqual('same', pyco.remove('two'))
+        self.assertEqual(2, len(pyco._instance_graph.toporder))
+
+    def test_factory_cache_policies(self):
+        built = []
+        def pool(size):
+            built.append(size)
+            return Pool(size)
+
+        # Stale products are rebuilt, along with their dependents.
+        pyco = Pycocontainer('TTL container')
+        pyco.add('size', 4)
+        pyco.register_factory(pool, 'pool', cache=Cache(ttl=0.05))
+        pyco.register(Client, 'client')
+        client = pyco.instance_of(Client, 'client')
+        pyco.start()
+        old = client.pool
+        self.assertIs(pyco.get('pool'), old)
+        time.sleep(0.06)
+        fresh = pyco.get('pool')
+        self.assertIsNot(fresh, old)
+        # Stepping the wall clock expires nothing.
+        wall = time.time
+        time.time = lambda: wall() + 3600
+        try:
+            self.assertIs(pyco.get('pool'), fresh)
+        finally:
+            time.time = wall
+        self.assertIs(pyco.get('client').pool, fresh)
+        self.assertEqual(pyco.get('client').stage, Stage.started)
+        self.assertEqual(client.stage, Stage.stopped)
+
+        # Only the most recently used products are kept.
+        pyco = Pycocontainer('LRU container')
+        pyco.add('small', 2)
+        pyco.add('large', 8)
+        pyco.register_factory(pool, 'pool', cache=Cache(size=1))
+        pyco.instance_of(pool, 'small_pool', {'size':'small'})
+        large = pyco.instance_of(pool, 'large_pool', {'size':'large'})
+        self.assertIsNone(pyco.get('small_pool'))
+        self.assertIs(pyco.get('large_pool'), large)
+        self.assertEqual([large], [x.value for x in pyco._instance_graph.toporder])
+
+    def test_async_instantiation(self):
+        # Coroutine factories and async hooks are covered in pycoasync.
+        pyco = self.pyco
+        pyco.register(A, 'a')
+        pyco.register(B, 'b')
+        # Only ainstance_of can finish components with an ainit method.
+        class Eager(object):
+            def __init__(self): pass
+            def ainit(self): pass
+        self.assertRaises(AsynchronousComponent, pyco.instance_of, Eager, 'eager')
+        self.assertIsNone(pyco.get('eager'))
+        if sys.version_info < (3, 5):
+            self.assertRaises(NotImplemented, pyco.ainstance_of, A, 'a')
+            return
+        import asyncio
+        run = getattr(asyncio, 'run', None) or asyncio.get_event_loop().run_until_complete
+        a = run(pyco.ainstance_of(A, 'a'))
+        self.assertIs(pyco.get('a'), a)
+        self.assertIs(pyco.get('b'), a.b)
+        self.assertEqual([a.b, a], pyco._instance_graph.toporder)
+
+    def test_background_start(self):
+        # Components become available as soon as their own subtree is up.
+        pyco = self.pyco
+        gate = threading.Event()
+        pyco.add('gate', gate)
+        pyco.register(Slow, 'slow')
+        pyco.register(Waiter, 'waiter')
+        pyco.register(B, 'b')
+        waiter = pyco.instance_of(Waiter, 'waiter')
+        b = pyco.instance_of(B, 'b')
+        self.assertIsNone(pyco.ready('b'))
+        overall = pyco.start_background()
+        self.assertTrue(pyco.ready('b').wait(1))
+        self.assertEqual(b.stage, Stage.started)
+        self.assertIs(pyco.get('b', 1), b)
+        self.assertFalse(pyco.ready('waiter').done())
+        self.assertRaises(LifecycleException, pyco.get, 'waiter', 0.01)
+        self.assertIsNone(pyco.ready('gate'))
+        self.assertEqual(pyco.stage, Stage.starting)
+
+        gate.set()
+        self.assertIs(pyco.get('waiter', 1), waiter)
+        self.assertEqual(waiter.stage, Stage.started)
+        self.assertTrue(overall.wait(1))
+        self.assertEqual(pyco.stage, Stage.started)
+
+    def test_background_start_pool(self):
+        # A bounded pool of workers does the starting, and a child container
+        # starts the instances of its parent it depends on first.
+        pyco = self.pyco
+        pyco.register(A, 'a')
+        pyco.register(B, 'b')
+        for i in range(10):
+            pyco.instance_of(B, 'b%s' % i)
+        tracer = pyco.trace()
+        pyco.count()
+        self.assertTrue(pyco.start_background(workers=2).wait(1))
+        self.assertEqual(10, len(tracer.events()))
+        self.assertEqual({'start': 10}, pyco.stats()['counters'])
+        self.assertTrue(len(set(x[4] for x in tracer.events())) <= 2)
+
+        b = pyco.instance_of(B, 'b')
+        child = pyco.child()
+        a = child.instance_of(A, 'a')
+        self.assertTrue(child.start_background().wait(1))
+        self.assertEqual(a.stage, Stage.started)
+        self.assertEqual(b.stage, Stage.started)
+
+    def test_background_start_failure(self):
+        # Failures resolve the readiness of the failed branch.
+        pyco = self.pyco
+        pyco.add('failures', 1)
+        pyco.register(Flaky, 'flaky')
+        pyco.register(Needy, 'needy')
+        pyco.register(B, 'b')
+        pyco.instance_of(Needy, 'needy')
+        pyco.instance_of(B, 'b')
+        overall = pyco.start_background()
+        self.assertRaises(IOError, overall.wait, 1)
+        self.assertRaises(IOError, pyco.ready('flaky').wait)
+        self.assertRaises(LifecycleException, pyco.ready('needy').wait)
+        self.assertTrue(pyco.ready('b').wait())
+
+    def test_profile_transitions(self):
+        # Profiles of the selected components end up in the directory.
+        pyco = self.pyco
+        pyco.register(A, 'a')
+        pyco.register(B, 'b')
+        pyco.instance_of(A, 'foo')
+        directory = tempfile.mkdtemp()
+        try:
+            pyco.profile(os.path.join(directory, 'boot'), 'b*')
+            pyco.start()
+            pyco.profile(None)
+            pyco.stop()
+            profiles = sorted(os.listdir(os.path.join(directory, 'boot')))
+            expected = ['b.start.pstats']
+            if sys.version_info >= (3, 4):
+                expected.insert(0, 'b.start.alloc.txt')
+            self.assertEqual(expected, profiles)
+            stats = pstats.Stats(os.path.join(directory, 'boot', 'b.start.pstats'))
+            self.assertIn('funk', [f[2] for f in stats.stats])
+            # foo is selected by the name of its component too.
+            pyco.profile(os.path.join(directory, 'component'), 'a')
+            pyco.start()
+            pyco.profile(None)
+            profiles = os.listdir(os.path.join(directory, 'component'))
+            self.assertEqual(['foo.start.pstats'], [x for x in profiles if x.endswith('.pstats')])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_trace_export(self):
+        # Instantiation and lifecycle spans export as Chrome trace events.
+        pyco = self.pyco
+        self.assertRaises(LifecycleException, pyco.export_trace, 'never.json')
+        pyco.register(A, 'a')
+        pyco.register(B, 'b')
+        tracer = pyco.trace()
+        pyco.instance_of(A, 'foo')
+        pyco.start()
+        pyco.stop()
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'boot.json')
+            pyco.export_trace(path)
+            with open(path) as f:
+                events = json.load(f)['traceEvents']
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual([('instantiate', 'b'), ('instantiate', 'foo'),
+                          ('start', 'b'), ('start', 'foo'),
+                          ('stop', 'foo'), ('stop', 'b')],
+                         [(x['cat'], x['name']) for x in events])
+        for event in events:
+            self.assertEqual('X', event['ph'])
+            self.assertTrue(event['dur'] >= 0)
+        self.assertEqual(['b'], events[1]['args']['depends_on'])
+        self.assertEqual([], events[0]['args']['depends_on'])
+        # The instantiation of b nests inside that of foo.
+        self.assertTrue(events[1]['ts'] <= events[0]['ts'])
+
+        # The buffer doesn't grow.
+        tracer = pyco.trace(2)
+        pyco.start()
+        pyco.stop()
+        self.assertEqual(2, len(tracer.events()))
+        self.assertEqual(2, tracer.dropped)
+        self.assertIsNone(pyco.trace(None))
+        self.assertRaises(LifecycleException, pyco.export_trace, path)
+
+    def test_stats(self):
+        # The container reports its size, its state and its counters.
+        pyco = Pycocontainer('Counted container', counters=True)
+        pyco.register(A, 'a')
+        pyco.register(B, 'b')
+        pyco.add('foo', 'bar')
+        pyco.instance_of(A, 'foo1')
+        pyco.instance_of(A, 'foo2')
+        pyco.instance_of(A, 'foo1')
+        pyco.start(pyco.get('foo1'))
+        stats = pyco.stats()
+        self.assertEqual({'A': 2, 'B': 1}, stats['instances'])
+        self.assertEqual(1, stats['constants'])
+        self.assertEqual(3, stats['vertices'])
+        self.assertEqual(2, stats['edges'])
+        self.assertEqual({'started': 2, 'stopped': 1}, stats['stages'])
+        counters = stats['counters']
+        self.assertEqual(3, counters['instance_of'])
+        self.assertEqual(1, counters['instance_of_hits'])
+        self.assertEqual(3, counters['instantiate'])
+        self.assertEqual(2, counters['max_depth'])
+        self.assertEqual(2, counters['start'])
+        self.assertEqual(5, stats['graph']['add'])
+        self.assertTrue(stats['graph']['toposort_seconds'] >= 0)
+
+        # Counters can be turned off entirely.
+        pyco.count(False)
+        pyco.instance_of(A, 'foo3')
+        stats = pyco.stats()
+        self.assertIsNone(stats['counters'])
+        self.assertIsNone(stats['graph'])
+        self.assertEqual(4, stats['vertices'])
+        self.assertIsNone(self.pyco.stats()['counters'])
+
+    def test_slotted_lifecycle(self):
+        # Slotted components carry no __dict__, and work like any other.
+        pyco = self.pyco
+        pyco.register(Slim, 'slim')
+        pyco.register(B, 'b')
+        slim = pyco.instance_of(Slim, 'slim')
+        self.assertFalse(hasattr(slim, '__dict__'))
+        self.assertTrue(hasattr(slim.b, '__dict__'))
+        self.assertEqual(slim.stage, Stage.stopped)
+        pyco.start()
+        self.assertEqual(slim.stage, Stage.started)
+        self.assertEqual(1, slim.counter)
+        pyco.stop(slim.b)
+        self.assertEqual(slim.stage, Stage.stopped)
+        self.assertEqual(0, slim.counter)
+        pyco.fail()
+        self.assertEqual(slim.stage, Stage.failed)
+        self.assertEqual('slim', pyco._component_registry[Slim].name)
+
+    def test_lifecycle_bases(self):
+        # Lifecycle shares a class with bases that have a layout of their own.
+        class Settings(Lifecycle, dict):
+            def __init__(self):
+                super(Settings, self).__init__()
+                self['debug'] = True
+
+            @startmethod
+            def load(self, *args): pass
+
+        class Fault(Lifecycle, Exception):
+            def __init__(self):
+                super(Fault, self).__init__()
+
+            @startmethod
+            def arm(self, *args): pass
+
+        settings = Settings()
+        self.assertEqual(settings.stage, Stage.stopped)
+        settings.load()
+        self.assertEqual(settings.stage, Stage.started)
+        self.assertTrue(settings['debug'])
+        pyco = self.pyco
+        fault = pyco.instance_of(Fault, 'fault')
+        pyco.start()
+        self.assertEqual(fault.stage, Stage.started)
+
 
 if __name__ == '__main__':
     unittest.main()